@@ -11,16 +11,27 @@ import fitz  # PyMuPDF
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.vectorstores import FAISS
 from langchain.schema import Document
-import concurrent.futures  # Added for parallel processing
 import re
 
 from modules.pdf_utils import extract_text_as_html, process_html_with_model, generate_fallback_pdf, save_pdf
 from modules.text_processing import (
-    process_chunk_with_change_detection, 
+    process_chunks_concurrent,
     find_instruction_targets, 
     prioritize_chunks
 )
 
+# Small batches with many in flight avoid head-of-line blocking on long chunks.
+# Only a continuous-batching backend (vLLM) runs batches concurrently - the HF
+# pipeline runs one batch at a time, as concurrent calls would contend for the GPU
+CHUNK_BATCH_SIZE = int(os.environ.get('CHUNK_BATCH_SIZE', 4))
+MAX_CONCURRENT_BATCHES = int(os.environ.get('MAX_CONCURRENT_BATCHES', 16))
+
+def concurrent_batches_for(text_generation_pipeline):
+    """Batches to keep in flight on this pipeline - 1 unless it batches continuously"""
+    if getattr(text_generation_pipeline, 'continuous_batching', False):
+        return MAX_CONCURRENT_BATCHES
+    return 1
+
 # Function to extract key entities from instruction
 def extract_key_entities(instruction):
     """Extract key entities like company names, addresses, etc. from instruction"""
@@ -206,39 +217,28 @@ def process_document(job_id, instruction, file_path, original_filename, embeddin
         total_chunks = len(chunks)
         changes_detected = False
         
-        # Define a worker function for parallel processing
-        def process_chunk_worker(args):
-            chunk, idx = args
-            chunk_id = f"{idx+1}/{total_chunks}"  # Format as "current/total"
-            result, changed = process_chunk_with_change_detection(chunk, instruction, chunk_id, text_generation_pipeline)
-            return idx, result, changed
+        # Batch chunks into shared pipeline calls, with several batches in flight on vLLM
+        max_concurrent_batches = concurrent_batches_for(text_generation_pipeline)
+        print(f"Processing {total_chunks} chunks in batches of {CHUNK_BATCH_SIZE} "
+              f"({max_concurrent_batches} concurrent)")
         
-        # Use parallel processing for chunks with ThreadPoolExecutor
-        # This is CPU-bound due to text processing, but also involves GPU for inference
-        # Adjust max_workers based on your system - typically num_cpu_cores is good
-        max_workers = min(total_chunks, os.cpu_count() or 4)
-        print(f"Processing {total_chunks} chunks with {max_workers} workers")
+        def report_progress(completed, total):
+            progress_pct = 40 + int(completed / total * 30)  # From 40% to 70%
+            job_results[job_id]['progress'] = progress_pct
+            job_results[job_id]['message'] = f"Processing document: {completed}/{total} chunks completed"
+            print(f"Progress: {completed}/{total} chunks processed")
         
-        chunk_args = [(chunk, i) for i, chunk in enumerate(chunks)]
-        
-        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-            futures = {executor.submit(process_chunk_worker, arg): arg for arg in chunk_args}
-            completed = 0
-            
-            for future in concurrent.futures.as_completed(futures):
-                idx, result, changed = future.result()
-                processed_chunks[idx] = result
-                completed += 1
-                
-                if changed:
-                    changes_detected = True
-                    print(f"Chunk {idx+1} was modified according to instruction")
-                
-                # Update progress
-                progress_pct = 40 + int(completed / total_chunks * 30)  # From 40% to 70%
-                job_results[job_id]['progress'] = progress_pct
-                job_results[job_id]['message'] = f"Processing document: {completed}/{total_chunks} chunks completed"
-                print(f"Progress: {completed}/{total_chunks} chunks processed")
+        chunk_results = process_chunks_concurrent(
+            chunks, instruction, text_generation_pipeline,
+            batch_size=CHUNK_BATCH_SIZE,
+            max_concurrent_batches=max_concurrent_batches,
+            progress_callback=report_progress
+        )
+        for idx, (result, changed) in enumerate(chunk_results):
+            processed_chunks[idx] = result
+            if changed:
+                changes_detected = True
+                print(f"Chunk {idx+1} was modified according to instruction")
         
         if not changes_detected:
             print("WARNING: No changes detected in any chunk. The instruction may not match document content.")
@@ -3,6 +3,73 @@ from transformers import AutoTokenizer, AutoModelForCausalLM, pipeline
 from langchain.embeddings import HuggingFaceEmbeddings
 from accelerate import Accelerator
 import os
+import asyncio
+import threading
+import uuid
+
+# vLLM (optional) - continuous batching with chunked prefill and prefix caching
+try:
+    from vllm import AsyncEngineArgs, AsyncLLMEngine, SamplingParams
+except ImportError:
+    AsyncLLMEngine = None
+
+# Generation backend: "hf" (transformers pipeline) or "vllm"
+LLM_BACKEND = os.environ.get('LLM_BACKEND', 'hf').lower()
+VLLM_MAX_NUM_BATCHED_TOKENS = int(os.environ.get('VLLM_MAX_NUM_BATCHED_TOKENS', 8192))
+
+# Drop-in replacement for the text-generation pipeline, served by vLLM
+class VLLMPipeline:
+    """Callable with the pipeline's calling convention, backed by an AsyncLLMEngine
+    
+    Calls from several threads land in the same engine, whose scheduler packs
+    their prefill chunks and decode steps into shared forward passes.
+    """
+    # Concurrent calls are merged by the engine's scheduler (continuous batching)
+    continuous_batching = True
+
+    def __init__(self, engine, tokenizer):
+        self.engine = engine
+        self.tokenizer = tokenizer
+        # The engine lives on its own event loop; callers block on futures
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(target=self._loop.run_forever, daemon=True).start()
+
+    async def _generate(self, prompt, sampling_params):
+        final_output = None
+        async for output in self.engine.generate(prompt, sampling_params, uuid.uuid4().hex):
+            final_output = output
+        return final_output.outputs[0].text
+
+    def __call__(self, prompts, max_new_tokens=4000, do_sample=False, eos_token_id=None, **kwargs):
+        single = isinstance(prompts, str)
+        if single:
+            prompts = [prompts]
+        
+        sampling_params = SamplingParams(
+            max_tokens=max_new_tokens,
+            temperature=0.4 if do_sample else 0.0,  # 0.0 is greedy, like do_sample=False
+            stop_token_ids=[eos_token_id] if eos_token_id is not None else None
+        )
+        futures = [asyncio.run_coroutine_threadsafe(self._generate(prompt, sampling_params), self._loop)
+                   for prompt in prompts]
+        outputs = [[{"generated_text": future.result()}] for future in futures]
+        return outputs[0] if single else outputs
+
+# Start a vLLM engine for the model
+def _initialize_vllm_pipeline(base_model_id, tokenizer):
+    """Create a VLLMPipeline with chunked prefill and prefix caching enabled"""
+    engine_args = AsyncEngineArgs(
+        model=base_model_id,
+        tokenizer=base_model_id,
+        trust_remote_code=True,
+        dtype="float16",
+        tensor_parallel_size=max(1, torch.cuda.device_count()),
+        max_model_len=32000,
+        enable_chunked_prefill=True,  # Long prompts are prefilled in chunks alongside decodes
+        enable_prefix_caching=True,   # The shared system prefix is prefilled once
+        max_num_batched_tokens=VLLM_MAX_NUM_BATCHED_TOKENS
+    )
+    return VLLMPipeline(AsyncLLMEngine.from_engine_args(engine_args), tokenizer)
 
 # Initialize ML components
 def initialize_models(base_model_id, embed_id):
@@ -32,6 +99,18 @@ def initialize_models(base_model_id, embed_id):
         trust_remote_code=True,
         model_max_length=32000  # Increased from 4096 to 32000 for larger context
     )
+    # Batched generation pads prompts - decoder-only models must pad on the left
+    tokenizer.padding_side = "left"
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+
+    if LLM_BACKEND == 'vllm':
+        if AsyncLLMEngine is not None:
+            print(f"Using vLLM backend (chunked prefill, max_num_batched_tokens={VLLM_MAX_NUM_BATCHED_TOKENS})")
+            text_generation_pipeline = _initialize_vllm_pipeline(base_model_id, tokenizer)
+            print("All components initialized successfully!")
+            return embedding, text_generation_pipeline
+        print("WARNING: LLM_BACKEND=vllm but vllm is not installed - falling back to transformers pipeline")
 
     # Load model with optimized configuration
     base_model = AutoModelForCausalLM.from_pretrained(
@@ -13,6 +13,21 @@ from bs4 import BeautifulSoup
 from xhtml2pdf import pisa
 import concurrent.futures
 
+# Signature block keywords for the fallback PDF classifier
+_SIGNATURE_RE = re.compile(r'signature|signed by|dated|provider:|client:', re.IGNORECASE)
+
+# selectolax (optional) - C-backed HTML tree, much lighter than BeautifulSoup
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:
+    LexborHTMLParser = None
+
+# rapidfuzz (optional) - C/SIMD string similarity for matching model lines to original lines
+try:
+    from rapidfuzz import process as fuzz_process, fuzz
+except ImportError:
+    fuzz_process = None
+
 # Extract text from PDF and convert to HTML to preserve formatting
 def extract_text_as_html(pdf_path):
     try:
@@ -139,8 +154,95 @@ def extract_text_as_html(pdf_path):
             print(f"Fallback extraction also failed: {str(e2)}")
             return ""
 
+# Map changed original lines to the model's version of them
+def _match_replacements(original_document, model_response):
+    """Return {original line: model line} for lines the model changed"""
+    # Split the model response and original document into lines for faster processing
+    model_lines = model_response.strip().split('\n')
+    original_lines = original_document.strip().split('\n')
+    
+    replacements = {}
+    
+    if fuzz_process is not None:
+        # Best original line per model line, scored in C; identical lines score
+        # 100 and need no replacement
+        orig_clean = list(dict.fromkeys(line.strip() for line in original_lines if line.strip()))
+        for model_line in model_lines:
+            model_line = model_line.strip()
+            if not model_line:
+                continue
+            match = fuzz_process.extractOne(model_line, orig_clean, scorer=fuzz.ratio, score_cutoff=70)
+            if match is not None and match[0] != model_line:
+                replacements[match[0]] = model_line
+        return replacements
+    
+    # Faster mapping approach using hash-based lookup
+    original_map = {line.strip(): i for i, line in enumerate(original_lines) if line.strip()}
+    
+    # For each line in the model response, try to find a match in the original
+    for model_line in model_lines:
+        model_line = model_line.strip()
+        if not model_line:
+            continue
+            
+        # Check for exact match first (fastest)
+        if model_line in original_map:
+            orig_line = original_lines[original_map[model_line]].strip()
+            if orig_line != model_line:  # Only add if different
+                replacements[orig_line] = model_line
+            continue
+        
+        # For non-exact matches, use a faster similarity approach
+        for orig_line in original_lines:
+            orig_line = orig_line.strip()
+            if not orig_line:
+                continue
+            
+            # Quick length check first
+            if abs(len(orig_line) - len(model_line)) > min(len(orig_line), len(model_line)) * 0.3:
+                continue
+            
+            # Check beginning similarity (faster than full comparison)
+            prefix_len = min(len(orig_line), len(model_line), 10)
+            if orig_line[:prefix_len].lower() == model_line[:prefix_len].lower():
+                # If beginnings match, this is likely a match with changes
+                if orig_line != model_line:  # Only add if different
+                    replacements[orig_line] = model_line
+                break
+    
+    return replacements
+
+# process_html_with_model on a selectolax tree
+def _process_html_selectolax(html_content, model_response):
+    """Apply the model's line changes to the text nodes of html_content"""
+    tree = LexborHTMLParser(html_content)
+    if tree.body is None:
+        # If no body found, create simple HTML
+        return f'<!DOCTYPE html><html><body><pre>{html.escape(model_response)}</pre></body></html>'
+    
+    # Collect all non-empty text nodes in one C-level traversal
+    text_nodes = [node for node in tree.body.traverse(include_text=True)
+                  if node.tag == '-text' and node.text_content.strip()]
+    original_document = "".join(node.text_content + "\n" for node in text_nodes)
+    
+    replacements = _match_replacements(original_document, model_response)
+    
+    # Replace the text nodes the model changed
+    for node in text_nodes:
+        text_stripped = node.text_content.strip()
+        if text_stripped in replacements:
+            node.replace_with(replacements[text_stripped])
+    
+    return tree.html
+
 # Process HTML with model changes - optimized version
 def process_html_with_model(html_content, model_response):
+    if LexborHTMLParser is not None:
+        try:
+            return _process_html_selectolax(html_content, model_response)
+        except Exception as e:
+            print(f"selectolax HTML processing failed, falling back to BeautifulSoup: {str(e)}")
+    
     try:
         # Parse the HTML - faster parsing with lxml
         soup = BeautifulSoup(html_content, 'lxml')
@@ -159,44 +261,7 @@ def process_html_with_model(html_content, model_response):
             # If no body found, create simple HTML
             return f'<!DOCTYPE html><html><body><pre>{html.escape(model_response)}</pre></body></html>'
         
-        # Split the model response and original document into lines for faster processing
-        model_lines = model_response.strip().split('\n')
-        original_lines = original_document.strip().split('\n')
-        
-        # Faster mapping approach using hash-based lookup
-        replacements = {}
-        original_map = {line.strip(): i for i, line in enumerate(original_lines) if line.strip()}
-        
-        # For each line in the model response, try to find a match in the original
-        for model_line in model_lines:
-            model_line = model_line.strip()
-            if not model_line:
-                continue
-                
-            # Check for exact match first (fastest)
-            if model_line in original_map:
-                orig_line = original_lines[original_map[model_line]].strip()
-                if orig_line != model_line:  # Only add if different
-                    replacements[orig_line] = model_line
-                continue
-            
-            # For non-exact matches, use a faster similarity approach
-            for orig_line in original_lines:
-                orig_line = orig_line.strip()
-                if not orig_line:
-                    continue
-                
-                # Quick length check first
-                if abs(len(orig_line) - len(model_line)) > min(len(orig_line), len(model_line)) * 0.3:
-                    continue
-                
-                # Check beginning similarity (faster than full comparison)
-                prefix_len = min(len(orig_line), len(model_line), 10)
-                if orig_line[:prefix_len].lower() == model_line[:prefix_len].lower():
-                    # If beginnings match, this is likely a match with changes
-                    if orig_line != model_line:  # Only add if different
-                        replacements[orig_line] = model_line
-                    break
+        replacements = _match_replacements(original_document, model_response)
         
         # Apply replacements to the soup - faster with direct replacements
         for text_node, parent in text_nodes:
@@ -272,38 +337,30 @@ def generate_fallback_pdf(pdf_buffer, text_content, job_id):
     # Faster content building
     content = []
     
-    # Split into paragraphs and process in batches for speed
-    paragraphs = text_content.split('\n\n')
-    batch_size = 20
-    
-    for batch_start in range(0, len(paragraphs), batch_size):
-        batch_end = min(batch_start + batch_size, len(paragraphs))
-        batch = paragraphs[batch_start:batch_end]
+    # Split into paragraphs and classify each one in a single pass
+    for para in text_content.split('\n\n'):
+        para_text = para.strip()
+        if not para_text:
+            # Add space for empty paragraphs
+            content.append(Spacer(1, 10))
+            continue
         
-        for para in batch:
-            if not para.strip():
-                # Add space for empty paragraphs
-                content.append(Spacer(1, 10))
-                continue
-                
-            para_text = para.strip()
-            
-            # Fast pattern matching for content types
-            is_heading = bool(para_text.isupper() or para_text.endswith(':') or 
-                             (len(para_text.split()) <= 8 and para_text.split()[0][0].isupper()))
-                
-            is_signature = any(pattern in para_text.lower() 
-                              for pattern in ['signature', 'signed by', 'dated', 'provider:', 'client:'])
+        # Fast pattern matching for content types - the word count is only
+        # needed for capitalized paragraphs and split() stops after 8 words
+        is_heading = (para_text.isupper() or para_text.endswith(':') or
+                      (para_text[0].isupper() and len(para_text.split(None, 8)) <= 8))
             
-            # Apply appropriate style
-            if is_signature:
-                content.append(Paragraph(para_text, signature_style))
-            elif is_heading:
-                content.append(Paragraph(para_text, heading_style))
-            else:
-                # Replace line breaks with <br/> for proper rendering
-                formatted_text = para_text.replace('\n', '<br/>')
-                content.append(Paragraph(formatted_text, normal_style))
+        is_signature = _SIGNATURE_RE.search(para_text) is not None
+        
+        # Apply appropriate style
+        if is_signature:
+            content.append(Paragraph(para_text, signature_style))
+        elif is_heading:
+            content.append(Paragraph(para_text, heading_style))
+        else:
+            # Replace line breaks with <br/> for proper rendering
+            formatted_text = para_text.replace('\n', '<br/>')
+            content.append(Paragraph(formatted_text, normal_style))
     
     # Build the document
     doc.build(content)
@@ -1,20 +1,10 @@
-from langchain.vectorstores import FAISS
-from langchain.schema import Document
 import re
+import asyncio
 import numpy as np
 
-# Process a single chunk sequentially with a simple direct approach
-def process_chunk(chunk, instruction, chunk_id, text_generation_pipeline):
-    try:
-        total_chunks = int(chunk_id.split('/')[1]) if '/' in str(chunk_id) else 1
-        current_chunk = int(chunk_id.split('/')[0]) if '/' in str(chunk_id) else chunk_id
-        
-        print(f"Processing chunk {current_chunk}/{total_chunks}")
-        
-        # Create Mistral-specific prompt format with [INST] and [/INST] tags
-        mistral_prompt = f"<s>[INST] "
-        # Add system prompt within the instruction
-        mistral_prompt += """You are a precise contract editor that strictly modifies legal documents according to user instructions.
+# Shared system prefix of every chunk prompt. Kept byte-identical across
+# chunks (no interpolation) so prefix-caching backends can reuse its KV cache.
+_SYSTEM_PREFIX = """<s>[INST] You are a precise contract editor that strictly modifies legal documents according to user instructions.
 
 Core requirements:
 1. You MUST make ALL changes requested in the user's instructions - this is CRITICAL
@@ -33,8 +23,16 @@ IMPORTANT NOTES:
 - Instructions often specify entity names with quotes (e.g., from 'ABC Inc.' to 'XYZ Corp.') - these are critical to replace correctly
 - If you can't find the exact text mentioned, look for similar text that matches the context
 """
-        
-        mistral_prompt += f"""You are processing chunk {current_chunk} of {total_chunks} of a document.
+
+# Build the Mistral prompt for a single chunk
+def _build_prompt(chunk, instruction, chunk_id):
+    """Build the [INST]-formatted prompt for one chunk"""
+    total_chunks = int(chunk_id.split('/')[1]) if '/' in str(chunk_id) else 1
+    current_chunk = int(chunk_id.split('/')[0]) if '/' in str(chunk_id) else chunk_id
+    
+    # Mistral-specific [INST] format - static system prefix, then the per-chunk tail
+    mistral_prompt = _SYSTEM_PREFIX
+    mistral_prompt += f"""You are processing chunk {current_chunk} of {total_chunks} of a document.
 
 Original text for chunk {current_chunk}/{total_chunks}: 
 "{chunk}"
@@ -45,33 +43,145 @@ Instruction to apply to this chunk: {instruction}
 The instruction may contain MULTIPLE changes to make. Implement ALL of them that apply to this chunk.
 Some instructions may not apply to this specific chunk but to other parts of the document.
 Return the FULL modified text for this chunk with ALL applicable changes implemented."""
-        mistral_prompt += " [/INST]"
+    mistral_prompt += " [/INST]"
+    return mistral_prompt
+
+# Generation limits for a set of chunks, sized from their real token counts
+def _generation_kwargs(chunks, text_generation_pipeline):
+    """max_new_tokens (and eos_token_id) for generating the longest of chunks"""
+    tokenizer = getattr(text_generation_pipeline, 'tokenizer', None)
+    if tokenizer is None:
+        # No tokenizer to count with - fall back to the character-based budget
+        return {'max_new_tokens': min(4000, max(len(chunk) for chunk in chunks) + 500)}
+    
+    # The edited chunk is about as long as the original, plus some slack
+    n_tok = max(len(tokenizer.encode(chunk, add_special_tokens=False)) for chunk in chunks)
+    return {
+        'max_new_tokens': min(4096, int(n_tok * 1.15) + 64),
+        'eos_token_id': tokenizer.eos_token_id  # Stop as soon as the answer is closed
+    }
+
+# Turn the generated text for a chunk into a (text, changed) result
+def _parse_response(chunk, chunk_response, chunk_id):
+    """Return (response, True), or (chunk, False) when the model produced nothing useful"""
+    # Debug response
+    response_length = len(chunk_response) if chunk_response else 0
+    print(f"Completed chunk {chunk_id} - Response length: {response_length} chars")
+    
+    # If response is empty or too short, return the original chunk
+    if not chunk_response or len(chunk_response) < 10:
+        print(f"WARNING: Empty or very short response for chunk {chunk_id}. Using original text.")
+        return chunk, False
         
-        # Use pipeline with optimized generation parameters
-        chunk_len = len(chunk)
-        max_tokens = min(4000, chunk_len + 500)  # Increased from 2000 to 4000 and added more buffer
+    return chunk_response, True
+
+# Process a single chunk sequentially with a simple direct approach
+def process_chunk(chunk, instruction, chunk_id, text_generation_pipeline):
+    try:
+        print(f"Processing chunk {chunk_id}")
+        mistral_prompt = _build_prompt(chunk, instruction, chunk_id)
         
+        # Use pipeline with optimized generation parameters
         chunk_response = text_generation_pipeline(
             mistral_prompt,
-            max_new_tokens=max_tokens,
-            do_sample=False  # Disable sampling for deterministic generation
+            do_sample=False,  # Disable sampling for deterministic generation
+            **_generation_kwargs([chunk], text_generation_pipeline)
         )[0]["generated_text"]
         
-        # Debug response
-        response_length = len(chunk_response) if chunk_response else 0
-        print(f"Completed chunk {current_chunk}/{total_chunks} - Response length: {response_length} chars")
-        
-        # If response is empty or too short, return the original chunk
-        if not chunk_response or len(chunk_response) < 10:
-            print(f"WARNING: Empty or very short response for chunk {current_chunk}/{total_chunks}. Using original text.")
-            return chunk, False
-            
-        return chunk_response, True
+        return _parse_response(chunk, chunk_response, chunk_id)
     except Exception as e:
         print(f"Error processing chunk {chunk_id}: {str(e)}")
         # Return original chunk on error
         return chunk, False
 
+# Run one batch of chunks through the pipeline
+def _run_batch(batch, chunk_ids, instruction, text_generation_pipeline, batch_size):
+    """Generate all chunks of a batch in one pipeline call; returns (text, changed) tuples"""
+    prompts = [_build_prompt(chunk, instruction, chunk_id) for chunk, chunk_id in zip(batch, chunk_ids)]
+    
+    try:
+        # One generation budget per batch, sized for its longest chunk
+        outputs = text_generation_pipeline(
+            prompts,
+            batch_size=batch_size,
+            do_sample=False,
+            **_generation_kwargs(batch, text_generation_pipeline)
+        )
+        return [_parse_response(chunk, output[0]["generated_text"], chunk_id)
+                for chunk, chunk_id, output in zip(batch, chunk_ids, outputs)]
+    except Exception as e:
+        print(f"Error processing chunks {chunk_ids[0]}-{chunk_ids[-1]}: {str(e)}")
+        # Return original chunks on error
+        return [(chunk, False) for chunk in batch]
+
+# Group chunks of similar length so a batch is not padded out to one long outlier
+def _length_buckets(chunks, batch_size):
+    """Return lists of chunk indices, batch_size at a time, in order of chunk length"""
+    order = np.argsort([len(chunk) for chunk in chunks], kind='stable').tolist()
+    return [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+
+# Process many chunks with one pipeline call per batch
+def process_chunks_batched(chunks, instruction, text_generation_pipeline, batch_size=8, progress_callback=None):
+    """Process chunks in batches so the GPU prefills several prompts per forward pass
+    
+    Returns a list of (text, changed) tuples in the same order as chunks.
+    progress_callback(completed, total) is called after every batch.
+    """
+    total_chunks = len(chunks)
+    results = [None] * total_chunks
+    completed = 0
+    
+    # Batches are formed from length buckets; results go back to their original slots
+    for indices in _length_buckets(chunks, batch_size):
+        batch = [chunks[i] for i in indices]
+        chunk_ids = [f"{i + 1}/{total_chunks}" for i in indices]
+        batch_results = _run_batch(batch, chunk_ids, instruction, text_generation_pipeline, batch_size)
+        for i, result in zip(indices, batch_results):
+            results[i] = result
+        
+        completed += len(indices)
+        if progress_callback:
+            progress_callback(completed, total_chunks)
+    
+    return results
+
+# Keep several small batches in flight so one long chunk cannot stall the rest
+def process_chunks_concurrent(chunks, instruction, text_generation_pipeline, batch_size=4,
+                              max_concurrent_batches=16, progress_callback=None):
+    """Like process_chunks_batched, but with up to max_concurrent_batches batches in flight
+    
+    Prompt building and response parsing of one batch overlap with generation of
+    the others, and a slow batch no longer blocks the ones queued behind it.
+    """
+    total_chunks = len(chunks)
+    if max_concurrent_batches > 1 and total_chunks < batch_size * max_concurrent_batches:
+        print(f"WARNING: {total_chunks} chunks cannot saturate {max_concurrent_batches} "
+              f"concurrent batches of {batch_size} - engine will be under-utilized")
+    
+    results = [None] * total_chunks
+    completed = 0
+    
+    async def process_batch_async(semaphore, indices):
+        nonlocal completed
+        batch = [chunks[i] for i in indices]
+        chunk_ids = [f"{i + 1}/{total_chunks}" for i in indices]
+        async with semaphore:
+            batch_results = await asyncio.to_thread(
+                _run_batch, batch, chunk_ids, instruction, text_generation_pipeline, batch_size)
+        for i, result in zip(indices, batch_results):
+            results[i] = result
+        completed += len(indices)
+        if progress_callback:
+            progress_callback(completed, total_chunks)
+    
+    async def run_all():
+        semaphore = asyncio.Semaphore(max_concurrent_batches)
+        await asyncio.gather(*[process_batch_async(semaphore, indices)
+                               for indices in _length_buckets(chunks, batch_size)])
+    
+    asyncio.run(run_all())
+    return results
+
 # Process a chunk with change detection
 def process_chunk_with_change_detection(chunk, instruction, chunk_id, text_generation_pipeline):
     """Process chunk and detect if changes were made"""
@@ -87,51 +197,58 @@ def find_instruction_targets(instruction, document):
     """Enhanced target identification for better chunk prioritization"""
     targets = []
     
+    # Loop invariants - lowercase and measure the document once
+    doc_len = len(document)
+    doc_lower = document.lower()
+    instruction_lower = instruction.lower()
+    
     # Extract quoted text (likely direct references)
     quoted_text = re.findall(r'"([^"]*)"', instruction)
     quoted_text.extend(re.findall(r"'([^']*)'", instruction))
     
     # Process each quoted text segment
     for text in quoted_text:
-        if len(text) > 3:
+        text_len = len(text)
+        if text_len > 3:
             # Look for case-insensitive matches
             text_lower = text.lower()
-            doc_lower = document.lower()
             
             # Try to find all occurrences 
             start_pos = 0
-            while start_pos < len(doc_lower):
+            while start_pos < doc_len:
                 found_pos = doc_lower.find(text_lower, start_pos)
                 if found_pos == -1:
                     break
                 
                 # Extract a context window around the match
                 context_start = max(0, found_pos - 100)
-                context_end = min(len(document), found_pos + len(text) + 200)
+                context_end = min(doc_len, found_pos + text_len + 200)
                 context = document[context_start:context_end]
                 targets.append(context)
                 
                 # Move to next position
-                start_pos = found_pos + len(text)
+                start_pos = found_pos + text_len
     
     # Split instruction into individual requests (common for multi-part instructions)
     instruction_parts = re.split(r'\n|\d+\.|\s*-\s*', instruction)
     
+    # Extract key verbs and subjects that indicate actions
+    action_verbs = ["change", "modify", "replace", "update", "set", "remove", "delete", "add", "insert"]
+    
     # Process each instruction part
     for part in instruction_parts:
         part = part.strip()
-        if len(part) < 5:  # Skip very short parts
+        part_len = len(part)
+        if part_len < 5:  # Skip very short parts
             continue
-            
-        # Extract key verbs and subjects that indicate actions
-        action_verbs = ["change", "modify", "replace", "update", "set", "remove", "delete", "add", "insert"]
+        part_lower = part.lower()
         
         # Look for action verbs followed by potential targets
         for verb in action_verbs:
-            if verb in part.lower():
-                verb_pos = part.lower().find(verb)
+            verb_pos = part_lower.find(verb)
+            if verb_pos >= 0:
                 # Extract the target phrase (text after the verb)
-                if verb_pos >= 0 and verb_pos + len(verb) + 1 < len(part):
+                if verb_pos + len(verb) + 1 < part_len:
                     target_phrase = part[verb_pos + len(verb):].strip()
                     if len(target_phrase) > 3:
                         # Find this phrase in the document
@@ -139,13 +256,12 @@ def find_instruction_targets(instruction, document):
                         search_terms = " ".join(target_phrase.split()[:3])
                         if len(search_terms) > 3:
                             # Look for the search terms in document
-                            doc_lower = document.lower()
                             search_lower = search_terms.lower()
                             found_pos = doc_lower.find(search_lower)
                             if found_pos >= 0:
                                 # Extract context around match
                                 context_start = max(0, found_pos - 100)
-                                context_end = min(len(document), found_pos + len(search_terms) + 200)
+                                context_end = min(doc_len, found_pos + len(search_terms) + 200)
                                 context = document[context_start:context_end]
                                 targets.append(context)
     
@@ -159,26 +275,25 @@ def find_instruction_targets(instruction, document):
     
     # Add any common fields mentioned in the instruction
     for field in common_fields:
-        if field in instruction.lower():
+        if field in instruction_lower:
             # Find this field in the document (could be multiple occurrences)
-            field_lower = field.lower()
-            doc_lower = document.lower()
+            field_len = len(field)
             
-            # Find all occurrences
+            # Find all occurrences (fields are already lowercase)
             start_pos = 0
-            while start_pos < len(doc_lower):
-                found_pos = doc_lower.find(field_lower, start_pos)
+            while start_pos < doc_len:
+                found_pos = doc_lower.find(field, start_pos)
                 if found_pos == -1:
                     break
                 
                 # Extract a context window around the match
                 context_start = max(0, found_pos - 50)
-                context_end = min(len(document), found_pos + len(field) + 200)
+                context_end = min(doc_len, found_pos + field_len + 200)
                 context = document[context_start:context_end]
                 targets.append(context)
                 
                 # Move to next position
-                start_pos = found_pos + len(field)
+                start_pos = found_pos + field_len
     
     # Remove duplicates and near-duplicates
     unique_targets = []
@@ -200,47 +315,55 @@ def find_instruction_targets(instruction, document):
 # Enhanced chunk prioritization
 def prioritize_chunks(chunks, targets):
     """Enhanced prioritization based on targets and chunk importance"""
+    # Lowercase every target and split the long ones in half once, not per chunk
+    targets_lower = []
+    for target in targets:
+        target_lower = target.lower()
+        half = len(target_lower) // 2
+        halves = (target_lower[:half], target_lower[half:]) if len(target_lower) > 10 else None
+        targets_lower.append((target_lower, halves))
+    
+    # Look for section headings/contract structure markers that might indicate important parts
+    structure_markers = [
+        "section", "article", "clause", "paragraph", 
+        "parties", "agreement", "witnesseth", "whereas",
+        "term", "termination", "payment", "services", "obligations",
+        "governing law", "liability", "indemnification"
+    ]
+    
     # Score each chunk based on target presence and relevance
     chunk_scores = []
     for i, chunk in enumerate(chunks):
         # Initialize score for this chunk
         score = 0
         chunk_lower = chunk.lower()
+        chunk_len = len(chunk)
+        thirds = chunk_len // 3
+        two_thirds = chunk_len * 2 // 3
         
         # Score based on target presence
-        for target in targets:
-            target_lower = target.lower()
-            
+        for target_lower, halves in targets_lower:
             # If target is fully contained in chunk, add higher score
-            if target_lower in chunk_lower:
+            target_pos = chunk_lower.find(target_lower)
+            if target_pos >= 0:
                 score += 5
                 
                 # Extra points if it's at the beginning or middle of the chunk (more likely to be complete)
-                target_pos = chunk_lower.find(target_lower)
-                if target_pos < len(chunk) // 3:  # In the first third
+                if target_pos < thirds:  # In the first third
                     score += 2
-                elif target_pos < len(chunk) * 2 // 3:  # In the middle third
+                elif target_pos < two_thirds:  # In the middle third
                     score += 1
             
             # If at least half of the target is in the chunk
-            elif len(target_lower) > 10:
+            elif halves:
                 # Check for partial matches (first half or second half)
-                first_half = target_lower[:len(target_lower)//2]
-                second_half = target_lower[len(target_lower)//2:]
+                first_half, second_half = halves
                 
                 if first_half in chunk_lower:
                     score += 2
                 if second_half in chunk_lower:
                     score += 2
         
-        # Look for section headings/contract structure markers that might indicate important parts
-        structure_markers = [
-            "section", "article", "clause", "paragraph", 
-            "parties", "agreement", "witnesseth", "whereas",
-            "term", "termination", "payment", "services", "obligations",
-            "governing law", "liability", "indemnification"
-        ]
-        
         # Add points for structure markers
         for marker in structure_markers:
             if marker in chunk_lower:
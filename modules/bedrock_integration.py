@@ -3,27 +3,62 @@ import os
 import time
 import boto3
 import logging
+import threading
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
 from dotenv import load_dotenv
 
 # Load environment variables from .env file (for local development)
 load_dotenv()
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+# Module logger - handlers and level are set by the application entrypoint
 logger = logging.getLogger('bedrock_integration')
 
 # Get AWS credentials from environment variables
 # These should be set in the environment, not hardcoded
 os.environ['AWS_REGION'] = os.environ.get('AWS_REGION', 'us-east-1')
 
+# Output token cap per chunk request - the model echoes the whole chunk back,
+# so chunk sizes are derived from this (see CHUNK_MAX_TOKENS in job_processing)
+BEDROCK_MAX_OUTPUT_TOKENS = int(os.environ.get('BEDROCK_MAX_OUTPUT_TOKENS', 8192))
+
+# One bedrock-runtime client for every BedrockClient - warmups keep warm the
+# same pooled keep-alive connections that user requests go out on
+_runtime_client = None
+_runtime_client_lock = threading.Lock()
+
+def get_runtime_client():
+    """Get or create the shared, pooled bedrock-runtime client"""
+    global _runtime_client
+    
+    if _runtime_client is not None:
+        return _runtime_client
+    
+    with _runtime_client_lock:
+        if _runtime_client is None:
+            # botocore makes a single attempt - retries and backoff are handled
+            # by BedrockClient._call_bedrock_with_retry, the only retry layer
+            config = Config(
+                max_pool_connections=int(os.environ.get('BEDROCK_MAX_POOL_CONNECTIONS', 32)),
+                tcp_keepalive=True,
+                retries={
+                    'total_max_attempts': 1,
+                    'mode': 'standard'
+                }
+            )
+            _runtime_client = boto3.client(
+                service_name='bedrock-runtime',
+                region_name=os.environ.get('AWS_REGION'),
+                config=config
+            )
+    
+    return _runtime_client
+
 class BedrockClient:
     def __init__(self):
         """Initialize the Bedrock client with credentials"""
         try:
-            self.bedrock_runtime = boto3.client(
-                service_name='bedrock-runtime',
-                region_name=os.environ.get('AWS_REGION')
-            )
+            self.bedrock_runtime = get_runtime_client()
             # Get the model ID from environment variable
             self.model_id = os.environ.get('BEDROCK_MODEL_ID', 'mistral.mistral-8b-instruct-v1:0')
             logger.info(f"Initialized Bedrock client in {os.environ.get('AWS_REGION')}")
@@ -38,7 +73,7 @@ class BedrockClient:
             total_chunks = int(chunk_id.split('/')[1]) if '/' in str(chunk_id) else 1
             current_chunk = int(chunk_id.split('/')[0]) if '/' in str(chunk_id) else chunk_id
             
-            logger.info(f"Processing chunk {current_chunk}/{total_chunks} with Bedrock")
+            logger.debug("Processing chunk %s/%s with Bedrock", current_chunk, total_chunks)
             
             # Create Mistral-specific prompt format with [INST] and [/INST] tags
             mistral_prompt = f"<s>[INST] "
@@ -84,13 +119,15 @@ Return the FULL modified text for this chunk with ALL applicable changes impleme
             mistral_prompt += " [/INST]"
             
             # Add debug logging
-            logger.info(f"Sending prompt to Bedrock (length: {len(mistral_prompt)})")
-            logger.info(f"Chunk preview: {chunk[:200]}...")
-            logger.info(f"Instruction: {instruction}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Sending prompt to Bedrock (length: %d)", len(mistral_prompt))
+                logger.debug("Chunk preview: %s...", chunk[:200])
+                logger.debug("Instruction: %s", instruction)
             
-            # Calculate max tokens based on input length - add buffer for the response
+            # Calculate max tokens based on input length - add buffer for the response.
+            # len/3 over-estimates tokens for contract text, leaving room for edits
             chunk_len = len(chunk)
-            max_tokens = min(4000, chunk_len + 500)
+            max_tokens = min(BEDROCK_MAX_OUTPUT_TOKENS, chunk_len // 3 + 500)
             
             # Make the API call to AWS Bedrock
             start_time = time.time()
@@ -104,9 +141,11 @@ Return the FULL modified text for this chunk with ALL applicable changes impleme
             # Extract the generated text from the response
             # Handle different response formats
             generated_text = ""
+            stop_reason = None
             if 'outputs' in response and len(response['outputs']) > 0:
                 # Format: {'outputs': [{'text': '...', 'stop_reason': 'stop'}]}
                 generated_text = response['outputs'][0].get('text', '')
+                stop_reason = response['outputs'][0].get('stop_reason')
             elif 'generation' in response:
                 # Format: {'generation': '...'}
                 generated_text = response.get('generation', '')
@@ -117,19 +156,24 @@ Return the FULL modified text for this chunk with ALL applicable changes impleme
             
             # Log metrics and debugging information
             response_length = len(generated_text) if generated_text else 0
-            logger.info(f"Completed chunk {current_chunk}/{total_chunks} - Response length: {response_length} chars in {time.time() - start_time:.2f}s")
+            logger.debug("Completed chunk %s/%s - Response length: %d chars in %.2fs",
+                         current_chunk, total_chunks, response_length, time.time() - start_time)
             
             # Add detailed response logging
-            if generated_text:
-                logger.info(f"Response preview: {generated_text[:300]}...")
+            if generated_text and logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Response preview: %s...", generated_text[:300])
                 
                 # Check if the response actually contains changes
-                chunk_lower = chunk.lower()
-                response_lower = generated_text.lower()
-                if chunk_lower != response_lower:
-                    logger.info("✅ Response differs from original chunk - changes detected")
+                if chunk.lower() != generated_text.lower():
+                    logger.debug("✅ Response differs from original chunk - changes detected")
                 else:
-                    logger.warning("⚠️ Response identical to original chunk - no changes detected")
+                    logger.debug("⚠️ Response identical to original chunk - no changes detected")
+            
+            # A response cut off at max_tokens is missing the end of the chunk -
+            # keep the original rather than drop the rest of it
+            if stop_reason == 'length':
+                logger.warning(f"Response truncated at {max_tokens} tokens for chunk {current_chunk}/{total_chunks}. Using original text.")
+                return chunk, False
             
             # If response is empty or too short, return the original chunk
             if not generated_text or len(generated_text) < 10:
@@ -143,34 +187,45 @@ Return the FULL modified text for this chunk with ALL applicable changes impleme
             # Return original chunk on error
             return chunk, False
 
-    def _call_bedrock_with_retry(self, model_id, prompt, max_tokens=4000, temperature=0.4, retries=3):
-        """Call AWS Bedrock with retry logic for transient errors"""
+    @staticmethod
+    def build_request_body(prompt, max_tokens=4000, temperature=0.4):
+        """Serialize the invoke_model request body for a prompt"""
+        request_body = {
+            "prompt": prompt,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "top_p": 0.7,
+            "top_k": 1,
+            "stop": ["</s>"]  # Ministral stop token
+        }
+        return json.dumps(request_body)
+
+    def _call_bedrock_with_retry(self, model_id, prompt=None, max_tokens=4000, temperature=0.4, retries=3, body=None):
+        """Call AWS Bedrock with retry logic for transient errors
+        
+        body, when given, is a request body already serialized with
+        build_request_body() and is sent as-is instead of prompt/max_tokens/temperature.
+        """
         last_exception = None
         backoff_time = 1  # Starting backoff time in seconds
         
+        # Serialize once - retries resend the same body
+        if body is None:
+            body = self.build_request_body(prompt, max_tokens, temperature)
+        
         for attempt in range(retries):
             try:
-                # Prepare the request body
-                request_body = {
-                    "prompt": prompt,
-                    "max_tokens": max_tokens,
-                    "temperature": temperature,
-                    "top_p": 0.7,
-                    "top_k": 1,
-                    "stop": ["</s>"]  # Ministral stop token
-                }
-                
                 # Make the API call
                 response = self.bedrock_runtime.invoke_model(
                     modelId=model_id,
-                    body=json.dumps(request_body)
+                    body=body
                 )
                 
                 # Parse the response
                 response_body = json.loads(response.get('body').read())
                 return response_body
                 
-            except boto3.exceptions.Boto3Error as e:
+            except (boto3.exceptions.Boto3Error, BotoCoreError, ClientError) as e:
                 last_exception = e
                 error_str = str(e)
                 
@@ -1,42 +1,14 @@
 import os
-import boto3
 import json
-import time
-from botocore.config import Config
 
-# Bedrock client singleton
-_bedrock_client = None
+from modules.bedrock_integration import get_runtime_client
 
+# Not on the request path (BedrockClient in bedrock_integration is) - kept for
+# ad-hoc scripts, and delegates to the same shared bedrock-runtime client so
+# there is a single pool/retry configuration
 def get_bedrock_client():
-    """Get or initialize the Bedrock client"""
-    global _bedrock_client
-    
-    if _bedrock_client is None:
-        # Get credentials from environment variables
-        aws_access_key = os.environ.get('AWS_ACCESS_KEY_ID')
-        aws_secret_key = os.environ.get('AWS_SECRET_ACCESS_KEY')
-        region = os.environ.get('AWS_REGION', 'us-east-1')
-        
-        # Check if credentials are available
-        if not aws_access_key or not aws_secret_key:
-            print("Warning: AWS credentials not found in environment variables.")
-            print("Please set AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY environment variables")
-            raise EnvironmentError("Missing AWS credentials. Cannot initialize Bedrock client.")
-        
-        max_attempts = int(os.environ.get('BEDROCK_MODEL_MAX_ATTEMPTS', 10))
-        config = Config(
-            retries={
-                'total_max_attempts': max_attempts,
-                'mode': 'standard'
-            }
-        )
-        _bedrock_client = boto3.client(
-            service_name='bedrock-runtime',
-            region_name=region,
-            config=config
-        )
-    
-    return _bedrock_client
+    """Get the shared bedrock-runtime client"""
+    return get_runtime_client()
 
 def invoke_mistral_model(prompt, max_tokens=4000, modelId=None):
     """Invoke the model via Bedrock with basic error handling"""
@@ -1,26 +1,48 @@
 import time
 import os
-from datetime import datetime
 import threading
 import queue
 import base64
 import html
-from io import BytesIO
 import fitz  # PyMuPDF
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 import concurrent.futures  # Added for parallel processing
 import re
+import logging
+import hashlib
+from collections import Counter
 
-from modules.pdf_utils import extract_text_as_html, process_html_with_model, generate_fallback_pdf, save_pdf
+from modules.job_store import JobStore, JOB_TTL_SECONDS
+from modules.pdf_utils import (
+    extract_text_as_html_cached, process_html_with_model, save_pdf, store_pdf, open_pdf,
+    GENERATED_PDF_DIR
+)
+from modules.bedrock_integration import BEDROCK_MAX_OUTPUT_TOKENS
 from modules.text_processing import (
     process_chunk_with_change_detection, 
     find_instruction_targets, 
-    prioritize_chunks
+    prioritize_chunks,
+    instruction_anchors,
+    count_tokens
 )
-from modules.bedrock_integration import BedrockClient
 
-# Initialize Bedrock client
-bedrock_client = BedrockClient()
+# Per-chunk diagnostics go through logging so production (INFO) skips the formatting
+logger = logging.getLogger('job_processing')
+
+# Chunk sizes are measured in model tokens. The model returns each chunk in full,
+# so a chunk is bounded by the output budget (2/3 of it, leaving headroom for
+# edits and tokenizer differences) - prompt + chunk + output then stays far
+# inside Mistral's 32K context
+CHUNK_MAX_TOKENS = int(os.environ.get('CHUNK_MAX_TOKENS', BEDROCK_MAX_OUTPUT_TOKENS * 2 // 3))
+CHUNK_OVERLAP_TOKENS = int(os.environ.get('CHUNK_OVERLAP_TOKENS', 500))
+
+# Shared token-aware splitter used by both processing paths
+text_splitter = RecursiveCharacterTextSplitter(
+    chunk_size=CHUNK_MAX_TOKENS,
+    chunk_overlap=CHUNK_OVERLAP_TOKENS,
+    length_function=count_tokens,
+    separators=["\n\n", "\n", " ", ""]
+)
 
 # Function to extract key entities from instruction
 def extract_key_entities(instruction):
@@ -50,35 +72,161 @@ def extract_key_entities(instruction):
     
     return unique_entities
 
-# Job processing queue and status tracking
-job_queue = queue.Queue()
-job_results = {}
-processing_thread = None
+# Group identical chunks so each distinct chunk is sent to Bedrock only once
+def group_duplicate_chunks(chunks):
+    """Map the index of each chunk's first occurrence to all positions sharing its content"""
+    first_index = {}
+    groups = {}
+    for i, chunk in enumerate(chunks):
+        digest = hashlib.sha256(chunk.encode('utf-8')).digest()
+        if digest in first_index:
+            groups[first_index[digest]].append(i)
+        else:
+            first_index[digest] = i
+            groups[i] = [i]
+    return groups
+
+# Remove a generated PDF from disk
+def remove_generated_pdf(pdf_path):
+    """Delete a generated PDF if it exists"""
+    if not pdf_path:
+        return
+    try:
+        if os.path.exists(pdf_path):
+            os.remove(pdf_path)
+            print(f"✅ Cleaned up file: {pdf_path}")
+    except Exception as e:
+        print(f"⚠️ Warning: Could not remove file {pdf_path}: {str(e)}")
+
+# Generated PDFs are content-addressed, so several jobs can share one file -
+# count the live jobs per file and delete it when the last one expires
+_pdf_refs = Counter()
+_pdf_refs_lock = threading.Lock()
+
+def store_job_pdf(pdf_buffer):
+    """Store a job's PDF and record the reference
+    
+    The file is written outside the lock, so job completions don't serialize on
+    disk writes; only the reference count is updated under it.
+    """
+    pdf_path = store_pdf(pdf_buffer)
+    with _pdf_refs_lock:
+        _pdf_refs[pdf_path] += 1
+        still_there = os.path.exists(pdf_path)
+    if not still_there:
+        # Another job's expiry (or the orphan sweep) removed the shared file between
+        # the write and the reference - our reference now pins it, write it again
+        store_pdf(pdf_buffer)
+    return pdf_path
+
+def release_pdf(pdf_path):
+    """Drop a job's reference to pdf_path, deleting the file with the last one"""
+    if not pdf_path:
+        return
+    with _pdf_refs_lock:
+        _pdf_refs[pdf_path] -= 1
+        if _pdf_refs[pdf_path] > 0:
+            return
+        del _pdf_refs[pdf_path]
+        remove_generated_pdf(pdf_path)
+
+# Reference counts live in memory, so files of jobs lost in a restart (and
+# leftovers of the direct-processing path) are never released - delete any
+# unreferenced file in generated_pdfs once it is older than the job TTL
+PDF_SWEEP_INTERVAL = 60 * 60  # seconds
+
+def sweep_orphaned_pdfs():
+    """Delete unreferenced generated PDFs older than JOB_TTL_SECONDS"""
+    cutoff = time.time() - JOB_TTL_SECONDS
+    removed = 0
+    try:
+        with os.scandir(GENERATED_PDF_DIR) as entries:
+            for entry in entries:
+                if not entry.is_file():
+                    continue
+                with _pdf_refs_lock:
+                    if _pdf_refs.get(entry.path) or entry.stat().st_mtime >= cutoff:
+                        continue
+                    os.remove(entry.path)
+                removed += 1
+    except FileNotFoundError:
+        return 0
+    except Exception as e:
+        print(f"⚠️ Warning: PDF sweep failed: {str(e)}")
+    if removed:
+        print(f"✅ Removed {removed} orphaned generated PDFs")
+    return removed
+
+# Expired and replaced jobs release their generated PDF
+def _release_expired_job_pdf(job):
+    release_pdf(job.get('pdf_path'))
+
+# Job queues are sharded - each shard is a lock-light SimpleQueue drained by its
+# own worker thread, so submissions never contend on a single queue
+JOB_QUEUE_SHARDS = int(os.environ.get('JOB_QUEUE_SHARDS', 4))
+WORKER_SUPERVISOR_INTERVAL = 5  # seconds between worker liveness checks
+
+# Jobs each shard worker keeps in flight at once - a freed slot is refilled
+# from the shard's queue as soon as any one job finishes
+JOB_SHARD_CONCURRENCY = int(os.environ.get('JOB_SHARD_CONCURRENCY', 4))
+
+# Job processing queues and status tracking
+job_queues = [queue.SimpleQueue() for _ in range(JOB_QUEUE_SHARDS)]
+job_store = JobStore(on_expire=_release_expired_job_pdf)
+processing_threads = []
+supervisor_thread = None
 should_process = True
 
+# Route a job to its shard - job IDs are uuid4 strings, so the leading hex is uniform
+def enqueue_job(job_id, instruction, file_path, original_filename):
+    """Queue a job on the shard owned by its job ID"""
+    shard = int(job_id[:8], 16) % len(job_queues)
+    job_queues[shard].put((job_id, instruction, file_path, original_filename))
+    return shard
+
+# Total number of jobs waiting across all shards
+def queued_job_count():
+    return sum(job_queue.qsize() for job_queue in job_queues)
+
+# Remove an uploaded document from disk (no-op for in-memory uploads)
+def cleanup_upload(file_path):
+    """Delete the uploaded file if the job was queued with a path on disk"""
+    if not isinstance(file_path, str):
+        return
+    try:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+            print(f"✅ Cleaned up uploaded file: {file_path}")
+    except Exception as e:
+        print(f"⚠️ Warning: Could not remove uploaded file {file_path}: {str(e)}")
+
 # Process document and generate response
 def process_document(job_id, instruction, file_path, original_filename):
-    """Process document with AWS Bedrock"""
+    """Process document with AWS Bedrock
+    
+    file_path is either a path on disk or the raw uploaded bytes; the document
+    type is always taken from original_filename.
+    """
     start_time = time.time()
     print(f"Starting job {job_id} with file: {original_filename}")
+    in_memory = isinstance(file_path, (bytes, bytearray))
     
     try:
         # Update job status
-        job_results[job_id]['status'] = 'processing'
-        job_results[job_id]['progress'] = 10
+        job_store.update(job_id, status='processing', progress=10)
         
         # Document content and chunking
         extract_start = time.time()
         document_content = ""
         html_content = ""
         
-        if file_path.lower().endswith('.pdf'):
+        if original_filename.lower().endswith('.pdf'):
             try:
                 # Extract as HTML to preserve formatting
-                html_content = extract_text_as_html(file_path)
+                html_content = extract_text_as_html_cached(file_path)
                 
                 # Also extract plain text for processing with the model
-                doc = fitz.open(file_path)
+                doc = open_pdf(file_path)
                 all_text = []
                 for page_num, page in enumerate(doc):
                     all_text.append(page.get_text())
@@ -87,14 +235,17 @@ def process_document(job_id, instruction, file_path, original_filename):
                 doc.close()
                 
                 # Update job status
-                job_results[job_id]['status'] = 'processing'
-                job_results[job_id]['progress'] = 30
-                job_results[job_id]['message'] = f"Extracted text from {len(all_text)} pages"
+                job_store.update(
+                    job_id,
+                    status='processing',
+                    progress=30,
+                    message=f"Extracted text from {len(all_text)} pages"
+                )
             except Exception as e:
                 print(f"Error during PDF text extraction: {str(e)}")
                 # Try simpler extraction
                 try:
-                    doc = fitz.open(file_path)
+                    doc = open_pdf(file_path)
                     document_content = ""
                     for page_num in range(len(doc)):
                         document_content += doc[page_num].get_text()
@@ -102,8 +253,16 @@ def process_document(job_id, instruction, file_path, original_filename):
                 except Exception as e2:
                     print(f"Secondary PDF extraction also failed: {str(e2)}")
                     # If both methods fail, try to read as binary
-                    with open(file_path, 'rb') as f:
-                        document_content = f.read().decode('utf-8', errors='replace')
+                    if in_memory:
+                        document_content = bytes(file_path).decode('utf-8', errors='replace')
+                    else:
+                        with open(file_path, 'rb') as f:
+                            document_content = f.read().decode('utf-8', errors='replace')
+        elif in_memory:
+            document_content = bytes(file_path).decode('utf-8', errors='replace')
+            
+            # Create simple HTML for non-PDF files
+            html_content = f'<!DOCTYPE html><html><body><pre>{html.escape(document_content)}</pre></body></html>'
         else:
             # For non-PDF files, just read the content
             with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
@@ -115,9 +274,7 @@ def process_document(job_id, instruction, file_path, original_filename):
         print(f"Text extraction time: {time.time() - extract_start:.2f} seconds")
 
         # Update job status
-        job_results[job_id]['status'] = 'processing'
-        job_results[job_id]['progress'] = 40
-        job_results[job_id]['message'] = "Text extracted, running inference..."
+        job_store.update(job_id, status='processing', progress=40, message="Text extracted, running inference...")
 
         # Process document content - we'll use the HTML for final output
         model_start = time.time()
@@ -129,17 +286,17 @@ def process_document(job_id, instruction, file_path, original_filename):
         entities_to_highlight = extract_key_entities(instruction)
         if entities_to_highlight:
             print(f"Identified {len(entities_to_highlight)} key entities to focus on: {', '.join(entities_to_highlight)}")
-            # Pre-scan document for these entities
+            # Pre-scan document for these entities - lowercase the document once
+            doc_lower = document_content.lower()
             found_entities = []
             for entity in entities_to_highlight:
-                if entity.lower() in document_content.lower():
+                entity_lower = entity.lower()
+                entity_pos = doc_lower.find(entity_lower)
+                if entity_pos >= 0:
                     found_entities.append(entity)
                     print(f"Found entity '{entity}' in document")
                     
                     # Add entire paragraphs containing this entity to target sections
-                    entity_lower = entity.lower()
-                    doc_lower = document_content.lower()
-                    entity_pos = doc_lower.find(entity_lower)
                     while entity_pos >= 0:
                         # Extract paragraph containing this entity
                         para_start = document_content.rfind('\n\n', 0, entity_pos)
@@ -168,11 +325,9 @@ def process_document(job_id, instruction, file_path, original_filename):
                     if len(words) >= 2:
                         for i in range(len(words) - 1):
                             partial = ' '.join(words[i:i+2])
-                            if len(partial) >= 5 and partial.lower() in document_content.lower():
+                            partial_pos = doc_lower.find(partial.lower()) if len(partial) >= 5 else -1
+                            if partial_pos >= 0:
                                 print(f"Found partial match for '{entity}': '{partial}'")
-                                doc_lower = document_content.lower()
-                                partial_lower = partial.lower()
-                                partial_pos = doc_lower.find(partial_lower)
                                 
                                 # Extract surrounding context
                                 context_start = max(0, partial_pos - 100)
@@ -180,33 +335,44 @@ def process_document(job_id, instruction, file_path, original_filename):
                                 context = document_content[context_start:context_end]
                                 target_sections.append(context)
         
-        # Smart chunking - use larger chunk size for faster processing, smaller overlap
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=25000,  # Changed from 80000 to 25000 characters per chunk
-            chunk_overlap=5000,  # Increased from 2000 to 5000 for better context preservation
-            length_function=len,
-            separators=["\n\n", "\n", " ", ""]
-        )
+        # Smart chunking - token-sized chunks keep Bedrock round-trips to a minimum
         chunks = text_splitter.split_text(document_content)
         
-        # Try to process the entire document if it's small enough
-        if len(document_content) < 25000:  # Updated threshold to match new chunk size
+        # Positions of chunks that cannot be affected by a targeted instruction
+        skip_positions = set()
+        
+        # Use HTML content for processing if available to preserve formatting
+        single_chunk = document_content
+        if html_content and len(html_content) > len(document_content):
+            single_chunk = html_content
+        
+        # Try to process the entire document if it's small enough - measured on
+        # the text that would actually be sent
+        if count_tokens(single_chunk) <= CHUNK_MAX_TOKENS:
             print("Document small enough to process in one chunk - skipping chunking")
-            # Use HTML content for processing if available to preserve formatting
-            if html_content and len(html_content) > len(document_content):
-                chunks = [html_content]
+            if single_chunk is html_content:
                 print("Using HTML content for processing to preserve formatting")
-            else:
-                chunks = [document_content]
+            chunks = [single_chunk]
         elif len(chunks) <= 2:
             print(f"Document can be processed with {len(chunks)} chunks")
         else:
             # If we have identified target sections, prioritize chunks containing them
             if target_sections:
                 print(f"Identified {len(target_sections)} potential target sections from instruction")
-                chunks = prioritize_chunks(chunks, target_sections)
+                chunks, chunk_scores = prioritize_chunks(chunks, target_sections)
                 print(f"Prioritized {len(chunks)} chunks based on relevance to instruction")
                 
+                # Targeted edits only touch chunks that score or mention an anchor;
+                # untargeted instructions fall back to sending every chunk
+                anchors = instruction_anchors(instruction)
+                if anchors:
+                    for idx, (chunk, score) in enumerate(zip(chunks, chunk_scores)):
+                        if score == 0:
+                            chunk_lower = chunk.lower()
+                            if not any(anchor in chunk_lower for anchor in anchors):
+                                skip_positions.add(idx)
+                    print(f"Skipping {len(skip_positions)} chunks with no relevance to the instruction")
+                
         # Process chunks with the model (plain text for now)
         processed_chunks = [None] * len(chunks)  # Pre-allocate result list
         total_chunks = len(chunks)
@@ -221,7 +387,7 @@ def process_document(job_id, instruction, file_path, original_filename):
                 return idx, result, changed
             except Exception as e:
                 error_msg = str(e)
-                print(f"Error processing chunk {chunk_id}: {error_msg}")
+                logger.error("Error processing chunk %s: %s", chunk_id, error_msg)
                 
                 # Check for credential errors
                 if "AWS Credentials Error" in error_msg or "security token" in error_msg.lower():
@@ -233,39 +399,48 @@ def process_document(job_id, instruction, file_path, original_filename):
         
         # Use parallel processing for chunks with ThreadPoolExecutor
         # Add rate limiting for Bedrock API
-        max_workers = min(total_chunks, 5)  # Limit to 5 concurrent requests to avoid rate limiting
-        print(f"Processing {total_chunks} chunks with {max_workers} workers via AWS Bedrock")
-        
-        chunk_args = [(chunk, i) for i, chunk in enumerate(chunks)]
+        # Repeated boilerplate chunks are only sent once; results are fanned back out
+        # Skipped chunks pass through unchanged (duplicates share a score, so
+        # a group is either skipped or sent as a whole)
+        chunk_groups = group_duplicate_chunks(chunks)
+        for idx in skip_positions:
+            processed_chunks[idx] = chunks[idx]
+        chunk_groups = {idx: positions for idx, positions in chunk_groups.items() if idx not in skip_positions}
+        chunk_args = [(chunks[i], i) for i in chunk_groups]
+        
+        max_workers = max(1, min(len(chunk_args), 5))  # Limit to 5 concurrent requests to avoid rate limiting
+        print(f"Processing {total_chunks} chunks ({len(chunk_args)} unique) with {max_workers} workers via AWS Bedrock")
         
         with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
             futures = {executor.submit(process_chunk_worker, arg): arg for arg in chunk_args}
-            completed = 0
+            completed = len(skip_positions)
             
             for future in concurrent.futures.as_completed(futures):
                 try:
                     idx, result, changed = future.result()
-                    processed_chunks[idx] = result
-                    completed += 1
+                    for position in chunk_groups[idx]:
+                        processed_chunks[position] = result
+                    completed += len(chunk_groups[idx])
                     
                     if changed:
                         changes_detected = True
-                        print(f"Chunk {idx+1} was modified according to instruction")
+                        logger.debug("Chunk %d was modified according to instruction", idx + 1)
                     
                     # Update progress
                     progress_pct = 40 + int(completed / total_chunks * 30)  # From 40% to 70%
-                    job_results[job_id]['progress'] = progress_pct
-                    job_results[job_id]['message'] = f"Processing document: {completed}/{total_chunks} chunks completed via AWS Bedrock"
-                    print(f"Progress: {completed}/{total_chunks} chunks processed")
+                    job_store.update(
+                        job_id,
+                        progress=progress_pct,
+                        message=f"Processing document: {completed}/{total_chunks} chunks completed via AWS Bedrock"
+                    )
+                    logger.debug("Progress: %d/%d chunks processed", completed, total_chunks)
                     
                 except Exception as e:
                     error_msg = str(e)
                     print(f"Critical error in chunk processing: {error_msg}")
                     
                     # Update job with error status
-                    job_results[job_id]['status'] = 'error'
-                    job_results[job_id]['message'] = f"Processing failed: {error_msg}"
-                    job_results[job_id]['progress'] = 100
+                    job_store.update(job_id, status='error', message=f"Processing failed: {error_msg}", progress=100)
                     raise Exception(error_msg)
         
         # Combine chunks
@@ -273,7 +448,8 @@ def process_document(job_id, instruction, file_path, original_filename):
         
         print(f"Model processing time: {time.time() - model_start:.2f} seconds")
         print(f"Combined response length: {len(combined_response)} characters")
-        print(f"Combined response preview: {combined_response[:500]}...")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Combined response preview: %s...", combined_response[:500])
         
         if not changes_detected:
             print("WARNING: No changes detected in any chunk. The instruction may not match document content.")
@@ -281,9 +457,7 @@ def process_document(job_id, instruction, file_path, original_filename):
             print(f"✅ Changes detected in document processing")
         
         # Update job status
-        job_results[job_id]['status'] = 'processing'
-        job_results[job_id]['progress'] = 70
-        job_results[job_id]['message'] = "Inference complete, generating PDF..."
+        job_store.update(job_id, status='processing', progress=70, message="Inference complete, generating PDF...")
 
         # Process HTML with the model to maintain structure
         html_processing_start = time.time()
@@ -302,57 +476,41 @@ def process_document(job_id, instruction, file_path, original_filename):
             pdf_buffer = generate_pdf(processed_html, combined_response)
             
             # Update job status
-            job_results[job_id]['status'] = 'processing'
-            job_results[job_id]['progress'] = 85
-            job_results[job_id]['message'] = "PDF generated successfully"
+            job_store.update(job_id, status='processing', progress=85, message="PDF generated successfully")
                 
         except Exception as e:
             print(f"PDF generation failed: {str(e)}")
             # Mark job as error
-            job_results[job_id]['status'] = 'error'
-            job_results[job_id]['message'] = f"PDF generation failed: {str(e)}"
-            job_results[job_id]['progress'] = 100
+            job_store.update(job_id, status='error', message=f"PDF generation failed: {str(e)}", progress=100)
             raise Exception(f"PDF generation failed: {str(e)}")
         
         print(f"PDF generation time: {time.time() - pdf_start:.2f} seconds")
         
-        # Save PDF to file temporarily (only for generating base64)
-        pdf_path = None
+        # Save PDF to a content-addressed file - the job keeps only its path, and
+        # /job_pdf and /job_result read the file on demand
         try:
-            pdf_path = save_pdf(pdf_buffer, original_filename)
-            # Encode PDF as base64 for sending to client
-            pdf_buffer.seek(0)
-            pdf_base64 = base64.b64encode(pdf_buffer.getvalue()).decode('utf-8')
+            pdf_path = store_job_pdf(pdf_buffer)
             
-            # Update job with results (don't store pdf_path since we'll delete it)
-            job_results[job_id]['status'] = 'completed'
-            job_results[job_id]['progress'] = 100
-            job_results[job_id]['message'] = "Processing complete"
-            job_results[job_id]['response'] = combined_response
-            job_results[job_id]['pdf_base64'] = pdf_base64
-            # Don't store pdf_path since file will be deleted
+            # Update job with results
+            job_store.update(
+                job_id,
+                status='completed',
+                progress=100,
+                message="Processing complete",
+                response=combined_response,
+                pdf_path=pdf_path,
+                pdf_filename=f"{os.path.splitext(original_filename)[0]}.pdf"
+            )
             
         except Exception as e:
             error_msg = f"Error saving PDF: {str(e)}"
             print(error_msg)
             # Update job with error
-            job_results[job_id]['status'] = 'error'
-            job_results[job_id]['message'] = error_msg
-            job_results[job_id]['progress'] = 100
+            job_store.update(job_id, status='error', message=error_msg, progress=100)
             raise Exception(error_msg)
         finally:
-            # Clean up all files - uploaded document and generated PDF
-            files_to_clean = [file_path]
-            if pdf_path:
-                files_to_clean.append(pdf_path)
-        
-            for file_to_remove in files_to_clean:
-                try:
-                    if os.path.exists(file_to_remove):
-                        os.remove(file_to_remove)
-                        print(f"✅ Cleaned up file: {file_to_remove}")
-                except Exception as e:
-                    print(f"⚠️ Warning: Could not remove file {file_to_remove}: {str(e)}")
+            # Clean up the uploaded document
+            cleanup_upload(file_path)
         
         print(f"Job {job_id} completed successfully in {time.time() - start_time:.2f} seconds")
         
@@ -362,52 +520,93 @@ def process_document(job_id, instruction, file_path, original_filename):
         print(error_msg)
         
         # Update job with error
-        job_results[job_id]['status'] = 'error'
-        job_results[job_id]['message'] = error_msg
-        job_results[job_id]['progress'] = 100
+        job_store.update(job_id, status='error', message=error_msg, progress=100)
         
         # Clean up uploaded file even on error
-        try:
-            if os.path.exists(file_path):
-                os.remove(file_path)
-                print(f"✅ Cleaned up uploaded file after error: {file_path}")
-        except Exception as cleanup_e:
-            print(f"⚠️ Warning: Could not remove uploaded file after error {file_path}: {str(cleanup_e)}")
+        cleanup_upload(file_path)
+
+# Done-callback of a shard job - report failures and free the job's slot
+def _finish_shard_job(future, job_id, slots):
+    try:
+        future.result()
+    except Exception as e:
+        print(f"Error processing job {job_id}: {str(e)}")
+    finally:
+        slots.release()
 
 # Job processing worker thread
-def process_jobs():
-    """Background thread for processing jobs from the queue - updated for Bedrock"""
-    while should_process:
-        try:
-            # Get a job from the queue with a timeout
+def process_jobs(shard):
+    """Background thread draining one job queue shard - updated for Bedrock"""
+    job_queue = job_queues[shard]
+    # Up to JOB_SHARD_CONCURRENCY jobs run side by side, so their Bedrock calls
+    # overlap on the shared connection pool. A job is only dequeued once a slot
+    # is free, so waiting jobs stay visible in the shard queue, and one slow job
+    # never holds back the others
+    slots = threading.BoundedSemaphore(JOB_SHARD_CONCURRENCY)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=JOB_SHARD_CONCURRENCY,
+                                               thread_name_prefix=f"job-{shard}") as job_executor:
+        while should_process:
             try:
-                job_id, instruction, file_path, original_filename = job_queue.get(timeout=1)
-                # Process the job with Bedrock
-                process_document(job_id, instruction, file_path, original_filename)
-            except queue.Empty:
-                # No jobs to process, wait a bit
-                time.sleep(0.1)
-                continue
+                if not slots.acquire(timeout=1):
+                    continue
                 
-        except Exception as e:
-            print(f"Error in job processing thread: {str(e)}")
-            time.sleep(1)  # Wait a bit before trying again
+                # Get a job from the queue with a timeout
+                try:
+                    job = job_queue.get(timeout=1)
+                except queue.Empty:
+                    slots.release()
+                    continue
+                
+                # Process the job with Bedrock
+                future = job_executor.submit(process_document, *job)
+                future.add_done_callback(
+                    lambda done, job_id=job[0]: _finish_shard_job(done, job_id, slots))
+                    
+            except Exception as e:
+                print(f"Error in job processing thread {shard}: {str(e)}")
+                time.sleep(1)  # Wait a bit before trying again
 
-# Start the job processing thread
-def start_processing_thread():
-    """Start the background thread for job processing - updated for Bedrock"""
-    global processing_thread
-    processing_thread = threading.Thread(
-        target=process_jobs, 
+# Start the worker thread for one shard
+def _start_worker(shard):
+    worker = threading.Thread(
+        target=process_jobs,
+        args=(shard,),
+        name=f"job-worker-{shard}",
         daemon=True
     )
-    processing_thread.start()
-    return processing_thread
+    worker.start()
+    return worker
+
+# Restart any shard worker that has died, so its queue is never orphaned
+def supervise_workers():
+    """Background thread that keeps one live worker per shard (and sweeps orphaned PDFs)"""
+    next_sweep = 0
+    while should_process:
+        if time.monotonic() >= next_sweep:
+            sweep_orphaned_pdfs()
+            next_sweep = time.monotonic() + PDF_SWEEP_INTERVAL
+        time.sleep(WORKER_SUPERVISOR_INTERVAL)
+        for shard, worker in enumerate(processing_threads):
+            if not worker.is_alive():
+                print(f"⚠️ Job worker {shard} died - restarting it")
+                processing_threads[shard] = _start_worker(shard)
+
+# Start the job processing threads
+def start_processing_threads():
+    """Start one worker per job queue shard plus their supervisor"""
+    global supervisor_thread
+    processing_threads[:] = [_start_worker(shard) for shard in range(len(job_queues))]
+    supervisor_thread = threading.Thread(
+        target=supervise_workers,
+        name="job-worker-supervisor",
+        daemon=True
+    )
+    supervisor_thread.start()
+    return processing_threads
 
 # Backward compatibility function - simplified version that doesn't use the job queue
 def process_with_bedrock(instruction, file_path, original_filename):
     """Process document using AWS Bedrock - simplified version for direct calls"""
-    import uuid
     from modules.pdf_utils import generate_pdf
     
     start_time = time.time()
@@ -415,7 +614,7 @@ def process_with_bedrock(instruction, file_path, original_filename):
         print("\n=== Starting direct Bedrock processing ===")
         
         # Extract as HTML to preserve formatting
-        html_content = extract_text_as_html(file_path)
+        html_content = extract_text_as_html_cached(file_path)
         
         # Also extract plain text for processing
         if file_path.lower().endswith('.pdf'):
@@ -428,16 +627,7 @@ def process_with_bedrock(instruction, file_path, original_filename):
             with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
                 document_content = f.read()
         
-        # Process document content using existing logic
-        target_sections = find_instruction_targets(instruction, document_content)
-        
         # Smart chunking
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=25000,
-            chunk_overlap=5000,
-            length_function=len,
-            separators=["\n\n", "\n", " ", ""]
-        )
         chunks = text_splitter.split_text(document_content)
         
         # Process chunks
@@ -451,19 +641,21 @@ def process_with_bedrock(instruction, file_path, original_filename):
                 result, changed = process_chunk_with_change_detection(chunk, instruction, chunk_id)
                 return idx, result, changed
             except Exception as e:
-                print(f"Error processing chunk {chunk_id}: {str(e)}")
+                logger.error("Error processing chunk %s: %s", chunk_id, e)
                 return idx, chunk, False
         
         # Use parallel processing
-        max_workers = min(total_chunks, 5)
+        chunk_groups = group_duplicate_chunks(chunks)
+        max_workers = min(len(chunk_groups), 5)
         
         with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-            chunk_args = [(chunk, i) for i, chunk in enumerate(chunks)]
+            chunk_args = [(chunks[i], i) for i in chunk_groups]
             futures = {executor.submit(process_chunk_worker, arg): arg for arg in chunk_args}
             
             for future in concurrent.futures.as_completed(futures):
                 idx, result, changed = future.result()
-                processed_chunks[idx] = result
+                for position in chunk_groups[idx]:
+                    processed_chunks[position] = result
         
         # Combine chunks
         combined_response = "\n\n".join(processed_chunks)
@@ -0,0 +1,112 @@
+import os
+import time
+import threading
+from collections import Counter, OrderedDict
+
+# Finished jobs (completed or error) are dropped this long after they finish
+JOB_TTL_SECONDS = int(os.environ.get('JOB_TTL_SECONDS', 24 * 60 * 60))
+
+# Statuses after which a job never changes again
+FINISHED_STATUSES = ('completed', 'error')
+
+class JobStore:
+    """
+    Thread-safe job status store with expiry of finished jobs
+
+    Request handlers and worker threads read and write jobs through get/set/update
+    instead of sharing a bare dict. Per-status counts are kept up to date on every
+    status transition, so reporting them never scans the jobs.
+    """
+    def __init__(self, ttl=JOB_TTL_SECONDS, on_expire=None):
+        self.ttl = ttl
+        # Called with the job's fields when a job leaves the store - a finished job
+        # expired, or set() replaced it - e.g. to delete its files
+        self.on_expire = on_expire
+        self._jobs = {}
+        # Finished job IDs in finish order -> expiry time; the TTL is fixed, so
+        # the oldest entry is always the next to expire
+        self._expiry = OrderedDict()
+        self._status_counts = Counter()
+        self._lock = threading.Lock()
+
+    def set(self, job_id, fields):
+        """Create or replace a job"""
+        with self._lock:
+            expired = self._purge_expired()
+            old_job = self._jobs.get(job_id)
+            if old_job is not None:
+                self._status_counts[old_job.get('status')] -= 1
+                expired.append(old_job)
+            self._jobs[job_id] = dict(fields)
+            self._track_status(job_id, fields.get('status'))
+        self._run_on_expire(expired)
+
+    def update(self, job_id, **fields):
+        """Update fields of an existing job - a no-op if the job has expired"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            new_status = fields.get('status')
+            if new_status is not None and new_status != job.get('status'):
+                self._status_counts[job.get('status')] -= 1
+                self._track_status(job_id, new_status)
+            job.update(fields)
+
+    def get(self, job_id):
+        """Snapshot of a job's fields, or None if unknown or expired"""
+        with self._lock:
+            expired = self._purge_expired()
+            job = self._jobs.get(job_id)
+            job = dict(job) if job is not None else None
+        self._run_on_expire(expired)
+        return job
+
+    def status_counts(self):
+        """Number of stored jobs per status"""
+        with self._lock:
+            expired = self._purge_expired()
+            counts = {status: count for status, count in self._status_counts.items() if count > 0}
+        self._run_on_expire(expired)
+        return counts
+
+    def __contains__(self, job_id):
+        return self.get(job_id) is not None
+
+    def __len__(self):
+        with self._lock:
+            expired = self._purge_expired()
+            job_count = len(self._jobs)
+        self._run_on_expire(expired)
+        return job_count
+
+    def _track_status(self, job_id, status):
+        # Caller holds the lock
+        self._status_counts[status] += 1
+        if status in FINISHED_STATUSES:
+            self._expiry[job_id] = time.monotonic() + self.ttl
+            self._expiry.move_to_end(job_id)
+        else:
+            self._expiry.pop(job_id, None)
+
+    def _purge_expired(self):
+        # Caller holds the lock - returns the expired jobs, whose on_expire the
+        # caller runs after releasing it (the callback may do disk I/O)
+        expired = []
+        now = time.monotonic()
+        while self._expiry:
+            job_id, expires_at = next(iter(self._expiry.items()))
+            if expires_at > now:
+                break
+            del self._expiry[job_id]
+            job = self._jobs.pop(job_id, None)
+            if job is not None:
+                self._status_counts[job.get('status')] -= 1
+                expired.append(job)
+        return expired
+    
+    def _run_on_expire(self, expired):
+        # Called without the lock held
+        if self.on_expire is not None:
+            for job in expired:
+                self.on_expire(job)
@@ -2,133 +2,293 @@ import fitz  # PyMuPDF
 from reportlab.lib.styles import getSampleStyleSheet
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
 from reportlab.lib.pagesizes import letter
-from io import BytesIO
+from io import BytesIO, StringIO
 import re
 import html
 import uuid
 import os
+import shutil
 from datetime import datetime
 from bs4 import BeautifulSoup
 from xhtml2pdf import pisa
 import concurrent.futures
+import hashlib
+import gc
+import sys
+import threading
+import multiprocessing
+import tempfile
+import ahocorasick
 
-# Extract text from PDF and convert to HTML to preserve formatting
-def extract_text_as_html(pdf_path):
+# Extracted HTML keyed by the SHA-256 of the PDF bytes, so re-submitting the same
+# document with a different instruction skips PyMuPDF extraction entirely
+EXTRACTION_CACHE_TTL = 24 * 60 * 60  # seconds
+try:
+    import diskcache
+    _extraction_cache = diskcache.Cache(os.environ.get(
+        'EXTRACTION_CACHE_DIR',
+        os.path.join(os.path.dirname(os.path.dirname(__file__)), "extraction_cache")))
+except ImportError:
+    _extraction_cache = None
+
+# CPUs this process may run on - os.cpu_count() reports the host's CPUs inside containers
+def _available_cpus():
     try:
-        doc = fitz.open(pdf_path)
-        html_output = ['<!DOCTYPE html><html><head><style>',
-                      'body { font-family: Times New Roman, serif; font-size: 11pt; line-height: 1.5; }',
-                      '.section { margin-top: 10px; margin-bottom: 10px; }',
-                      '.signature { margin-top: 20px; margin-bottom: 20px; }',
-                      '.heading { font-weight: bold; }',
-                      '.indent { margin-left: 20px; }',
-                      '.clause { margin-top: 10px; margin-bottom: 10px; }',
-                      '.paragraph { margin-top: 6px; margin-bottom: 6px; }',
-                      '</style></head><body>']
-        
-        # Process pages in parallel for faster extraction
-        def process_page(page_info):
-            page_num, page = page_info
-            page_width = page.rect.width
-            page_html = []
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # Not available on macOS/Windows
+        return os.cpu_count() or 1
+
+# Worker processes for PDF work (rendering and page extraction share it) - each
+# is a full interpreter with ReportLab/PyMuPDF loaded, so keep it small
+PDF_PROCESS_BUDGET = int(os.environ.get('PDF_PROCESS_BUDGET', min(4, _available_cpus())))
+
+# xhtml2pdf render processes (0 renders in-process) and renders per process before it is replaced
+PDF_RENDER_PROCESSES = int(os.environ.get('PDF_RENDER_PROCESSES', max(1, PDF_PROCESS_BUDGET // 2)))
+PDF_WORKER_MAX_TASKS = int(os.environ.get('PDF_WORKER_MAX_TASKS', 50))
+
+# PDFs larger than this trigger an explicit garbage collection after rendering
+GC_AFTER_PDF_BYTES = 1024 * 1024
+
+# Minimal document using the same fonts as extracted HTML, for renderer warm-up
+_PDF_WARMUP_HTML = ('<!DOCTYPE html><html><head><style>'
+                    'body { font-family: Times New Roman, serif; font-size: 11pt; }'
+                    '</style></head><body><h2>Warm-up</h2><div>Warm-up</div></body></html>')
+
+# Line classifiers, compiled once instead of per line
+_HEADING_RE = re.compile(r'^\d+\.(\d+\.?)?\s+[A-Z]')
+_CLAUSE_NUM_RE = re.compile(r'^\d+\.')
+_CLAUSE_ALPHA_RE = re.compile(r'^[a-z]\)')
+
+# Signature keywords, matched in a single pass over the casefolded text
+def _keyword_automaton(keywords):
+    automaton = ahocorasick.Automaton()
+    for keyword in keywords:
+        automaton.add_word(keyword, keyword)
+    automaton.make_automaton()
+    return automaton
+
+_SIG_AC = _keyword_automaton(['signature', 'signed by', 'dated', 'provider:', 'client:'])
+_PARA_SIG_AC = _keyword_automaton(['signature', 'signed by', 'dated', 'by:', 'name:', 'title:'])
+
+def _has_keyword(automaton, text):
+    return next(automaton.iter(text.casefold()), None) is not None
+
+# HTML emitted per extracted line, indexed by line kind - each template is
+# (text before the element id, text between id and content, closing text)
+_LINE_SIGNATURE, _LINE_TITLE, _LINE_HEADING, _LINE_CLAUSE, _LINE_INDENT, _LINE_PARAGRAPH = range(6)
+_LINE_TEMPLATES = (
+    ('<div id="', '" class="signature">', '</div>\n'),
+    ('<h1 id="', '" class="heading" align="center">', '</h1>\n'),
+    ('<h2 id="', '" class="heading">', '</h2>\n'),
+    ('<div id="', '" class="clause">', '</div>\n'),
+    ('<div id="', '" class="indent">', '</div>\n'),
+    ('<div id="', '" class="paragraph">', '</div>\n'),
+)
+
+# get_text("dict") flags without image blocks. TEXTFLAGS_TEXT only exists in newer
+# PyMuPDF; older versions get the same bits spelled out (preserve ligatures |
+# preserve whitespace | clip to mediabox - no TEXT_PRESERVE_IMAGES)
+_TEXT_DICT_FLAGS = getattr(fitz, 'TEXTFLAGS_TEXT', 1 | 2 | 64)
+
+# Open a PDF from a path on disk or from raw bytes already in memory
+def open_pdf(pdf_source):
+    """Open a PDF given either a file path or the raw PDF bytes"""
+    if isinstance(pdf_source, (bytes, bytearray, memoryview)):
+        return fitz.open(stream=pdf_source, filetype='pdf')
+    return fitz.open(pdf_source)
+
+# Documents with at least this many pages are extracted in the page pool
+PAGE_PROCESS_POOL_MIN_PAGES = int(os.environ.get('PAGE_PROCESS_POOL_MIN_PAGES', 8))
+
+# Page-extraction processes shared by every job (0 extracts in-process) - by
+# default whatever PDF_PROCESS_BUDGET leaves after the render pool
+PAGE_EXTRACT_PROCESSES = int(os.environ.get('PAGE_EXTRACT_PROCESSES',
+                                            max(0, PDF_PROCESS_BUDGET - max(0, PDF_RENDER_PROCESSES))))
+
+# Convert one page of a PDF into HTML, streamed into one buffer
+def _process_page(page_num, doc):
+    """Render one page as newline-terminated HTML lines"""
+    page = doc[page_num]
+    page_width = page.rect.width
+    page_html = StringIO()
+    bold_fonts = {}  # font name -> "bold" in name
+    
+    # Extract text blocks with position information
+    # Text-only flags leave out image blocks, which are skipped below anyway
+    blocks = page.get_text("dict", flags=_TEXT_DICT_FLAGS)["blocks"]
+    
+    for block in blocks:
+        if "lines" not in block:
+            continue
             
-            # Extract text blocks with position information
-            blocks = page.get_text("dict")["blocks"]
+        # Process each line of text with its position and style information
+        for line in block["lines"]:
+            line_text = ""
+            is_centered = False
+            is_bold = False
+            is_heading = False
             
-            for block in blocks:
-                if "lines" not in block:
-                    continue
-                    
-                # Process each line of text with its position and style information
-                for line in block["lines"]:
-                    line_text = ""
-                    is_centered = False
-                    is_bold = False
-                    is_heading = False
-                    
-                    # Calculate line position (centered, left, etc.)
-                    line_x0 = min(span["bbox"][0] for span in line["spans"]) if line["spans"] else 0
-                    line_x1 = max(span["bbox"][2] for span in line["spans"]) if line["spans"] else 0
-                    line_width = line_x1 - line_x0
-                    line_center = line_x0 + (line_width / 2)
-                    
-                    # Check if line appears centered - simplified calculation
-                    if abs(line_center - (page_width / 2)) < 50 and line_width < (page_width * 0.7):
-                        is_centered = True
-                    
-                    # Extract text content and detect formatting
-                    for span in line["spans"]:
-                        span_text = span["text"]
-                        line_text += span_text
-                        
-                        # Check for bold text - simplified check
-                        if "bold" in span.get("font", "").lower() or span.get("flags", 0) & 16:
-                            is_bold = True
-                    
-                    # Skip empty lines but add a spacer
-                    if not line_text.strip():
-                        page_html.append('<div style="height: 12px;"></div>')
-                        continue
-                    
-                    # Fast pattern matching for content types
-                    # Check for headings (most common patterns)
-                    if (is_bold or line_text.isupper() or 
-                        line_text.strip().endswith(':') or 
-                        re.match(r'^\d+\.(\d+\.?)?\s+[A-Z]', line_text.strip())):
-                        is_heading = True
-                    
-                    # Check for signature blocks (common patterns)
-                    is_signature = False
-                    if any(pattern in line_text.lower() for pattern in ['signature', 'signed by', 'dated', 'provider:', 'client:']):
-                        is_signature = True
-                    
-                    # Check for clauses (simple pattern)
-                    is_clause = bool(re.match(r'^\d+\.', line_text.strip()) or re.match(r'^[a-z]\)', line_text.strip()))
-                    
-                    # Add appropriate HTML tags with unique IDs for better targeting
-                    element_id = f"elem_{page_num}_{block['number']}_{line['spans'][0]['origin'][1]}"
-                    
-                    # Use faster string concatenation for HTML
-                    if is_signature:
-                        page_html.append(f'<div id="{element_id}" class="signature">{html.escape(line_text)}</div>')
-                    elif is_heading:
-                        if is_centered:
-                            page_html.append(f'<h1 id="{element_id}" class="heading" align="center">{html.escape(line_text)}</h1>')
-                        else:
-                            page_html.append(f'<h2 id="{element_id}" class="heading">{html.escape(line_text)}</h2>')
-                    elif is_clause:
-                        page_html.append(f'<div id="{element_id}" class="clause">{html.escape(line_text)}</div>')
-                    elif line_x0 > 100:  # Indented text
-                        page_html.append(f'<div id="{element_id}" class="indent">{html.escape(line_text)}</div>')
-                    else:
-                        page_html.append(f'<div id="{element_id}" class="paragraph">{html.escape(line_text)}</div>')
+            # Calculate line position (centered, left, etc.)
+            line_x0, _, line_x1, _ = line["bbox"]
+            line_width = line_x1 - line_x0
+            line_center = line_x0 + (line_width / 2)
             
-            return page_html
-        
-        # Parallel processing of pages
-        page_infos = [(i, doc[i]) for i in range(len(doc))]
+            # Check if line appears centered - simplified calculation
+            if abs(line_center - (page_width / 2)) < 50 and line_width < (page_width * 0.7):
+                is_centered = True
+            
+            # Extract text content and detect formatting
+            for span in line["spans"]:
+                span_text = span["text"]
+                line_text += span_text
+                
+                # Check for bold text - by font flag, or by font name (memoized,
+                # a page only uses a handful of fonts across all its spans)
+                if not is_bold:
+                    font_name = span.get("font", "")
+                    bold_by_name = bold_fonts.get(font_name)
+                    if bold_by_name is None:
+                        bold_by_name = bold_fonts[font_name] = "bold" in font_name.lower()
+                    is_bold = bold_by_name or bool(span.get("flags", 0) & 16)
+            
+            # Skip empty lines but add a spacer
+            if not line_text.strip():
+                page_html.write('<div style="height: 12px;"></div>\n')
+                continue
+            
+            # Fast pattern matching for content types
+            stripped_text = line_text.strip()
+            # Check for headings (most common patterns)
+            if (is_bold or line_text.isupper() or 
+                stripped_text.endswith(':') or 
+                _HEADING_RE.match(stripped_text)):
+                is_heading = True
+            
+            # Check for signature blocks (common patterns)
+            is_signature = _has_keyword(_SIG_AC, line_text)
+            
+            # Check for clauses (simple pattern)
+            is_clause = bool(_CLAUSE_NUM_RE.match(stripped_text) or _CLAUSE_ALPHA_RE.match(stripped_text))
+            
+            # Add appropriate HTML tags with unique IDs for better targeting
+            element_id = f"elem_{page_num}_{block['number']}_{line['spans'][0]['origin'][1]}"
+            
+            # Pick the line's template by kind and splice in id and text with one write
+            if is_signature:
+                kind = _LINE_SIGNATURE
+            elif is_heading:
+                kind = _LINE_TITLE if is_centered else _LINE_HEADING
+            elif is_clause:
+                kind = _LINE_CLAUSE
+            elif line_x0 > 100:  # Indented text
+                kind = _LINE_INDENT
+            else:
+                kind = _LINE_PARAGRAPH
+            open_tag, mid_tag, close_tag = _LINE_TEMPLATES[kind]
+            page_html.write(f'{open_tag}{element_id}{mid_tag}{html.escape(line_text)}{close_tag}')
+    
+    return page_html.getvalue()
+
+# Convert a contiguous range of pages - runs inside a page pool worker. fitz
+# pages don't pickle, so workers open the file themselves and get page numbers
+def _process_page_range(pdf_path, start, stop):
+    """HTML of pages start..stop-1 of the PDF at pdf_path"""
+    doc = open_pdf(pdf_path)
+    try:
+        return ''.join(_process_page(page_num, doc) for page_num in range(start, stop))
+    finally:
+        doc.close()
+
+# Process pool for page extraction - pages are CPU-bound and hold the GIL. One
+# long-lived pool bounds extraction processes across all concurrent jobs, and
+# workers are spawned (the server process is multithreaded, so no fork)
+_page_pool = None
+_page_pool_lock = threading.Lock()
+
+def _get_page_pool():
+    """Get or create the page extraction pool (None when disabled)"""
+    global _page_pool
+    
+    if _page_pool is not None or PAGE_EXTRACT_PROCESSES <= 0:
+        return _page_pool
+    
+    with _page_pool_lock:
+        if _page_pool is None:
+            _page_pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=PAGE_EXTRACT_PROCESSES,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+    return _page_pool
+
+# Extract all pages in the pool, one contiguous page range per worker
+def _extract_pages_in_pool(pool, pdf_source, page_count):
+    """HTML of every page, in page order"""
+    temp_path = None
+    if isinstance(pdf_source, (bytes, bytearray, memoryview)):
+        # Spill in-memory PDFs to disk once, so workers are sent a path, not the bytes
+        fd, temp_path = tempfile.mkstemp(suffix='.pdf')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(pdf_source)
+        pdf_source = temp_path
+    
+    try:
+        range_size = -(-page_count // min(PAGE_EXTRACT_PROCESSES, page_count))
+        futures = [pool.submit(_process_page_range, pdf_source, start, min(start + range_size, page_count))
+                   for start in range(0, page_count, range_size)]
+        return [future.result() for future in futures]
+    finally:
+        if temp_path is not None:
+            os.remove(temp_path)
+
+# Extract text from PDF and convert to HTML to preserve formatting
+def extract_text_as_html(pdf_path):
+    """Extract the PDF at pdf_path (a path or raw PDF bytes) as styled HTML"""
+    global _page_pool
+    
+    try:
+        doc = open_pdf(pdf_path)
+        # Single growable buffer - avoids holding a list of every line plus a final join pass
+        html_output = StringIO()
+        html_output.write('<!DOCTYPE html><html><head><style>\n'
+                          'body { font-family: Times New Roman, serif; font-size: 11pt; line-height: 1.5; }\n'
+                          '.section { margin-top: 10px; margin-bottom: 10px; }\n'
+                          '.signature { margin-top: 20px; margin-bottom: 20px; }\n'
+                          '.heading { font-weight: bold; }\n'
+                          '.indent { margin-left: 20px; }\n'
+                          '.clause { margin-top: 10px; margin-bottom: 10px; }\n'
+                          '.paragraph { margin-top: 6px; margin-bottom: 6px; }\n'
+                          '</style></head><body>\n')
         
-        # Use ThreadPoolExecutor for parallel processing
-        max_workers = min(os.cpu_count() or 4, len(page_infos))
-        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-            results = list(executor.map(process_page, page_infos))
+        # Pages are CPU-bound (dict traversal, regex, string building) and hold the
+        # GIL - long documents fan out to the page pool, short ones stay inline
+        page_count = len(doc)
+        results = None
+        pool = _get_page_pool() if page_count >= PAGE_PROCESS_POOL_MIN_PAGES else None
+        if pool is not None:
+            try:
+                results = _extract_pages_in_pool(pool, pdf_path, page_count)
+            except concurrent.futures.process.BrokenProcessPool:
+                print("⚠️ Page pool broken - restarting it, extracting this document in-process")
+                with _page_pool_lock:
+                    if _page_pool is pool:
+                        _page_pool = None
+        if results is None:
+            results = [_process_page(page_num, doc) for page_num in range(page_count)]
         
         # Combine results from all pages
         for page_html in results:
-            html_output.extend(page_html)
+            html_output.write(page_html)
         
-        html_output.append('</body></html>')
+        html_output.write('</body></html>')
         doc.close()
         
-        return '\n'.join(html_output)
+        return html_output.getvalue()
     except Exception as e:
         print(f"Error extracting HTML from PDF: {str(e)}")
         # Fallback to simple text extraction
         try:
-            doc = fitz.open(pdf_path)
-            text_content = ""
-            for page_num in range(len(doc)):
-                text_content += doc[page_num].get_text()
+            doc = open_pdf(pdf_path)
+            text_content = ''.join([page.get_text() for page in doc])
             doc.close()
             
             # Convert plain text to simple HTML
@@ -138,6 +298,29 @@ def extract_text_as_html(pdf_path):
             print(f"Fallback extraction also failed: {str(e2)}")
             return ""
 
+# Memoized extraction - same PDF bytes always yield the same HTML
+def extract_text_as_html_cached(pdf_source):
+    """extract_text_as_html, cached on disk by the SHA-256 of the PDF content"""
+    if _extraction_cache is None:
+        return extract_text_as_html(pdf_source)
+    
+    if isinstance(pdf_source, (bytes, bytearray, memoryview)):
+        pdf_bytes = pdf_source
+    else:
+        with open(pdf_source, 'rb') as f:
+            pdf_bytes = f.read()
+    file_sha256 = hashlib.sha256(pdf_bytes).hexdigest()
+    
+    html_content = _extraction_cache.get(file_sha256)
+    if html_content is not None:
+        print(f"Using cached HTML extraction for {file_sha256[:12]}")
+        return html_content
+    
+    html_content = extract_text_as_html(pdf_bytes)
+    if html_content:
+        _extraction_cache.set(file_sha256, html_content, expire=EXTRACTION_CACHE_TTL)
+    return html_content
+
 # Process HTML with model changes - preserve original structure
 def process_html_with_model(html_content, model_response):
     """Process HTML with model changes while preserving original structure"""
@@ -220,7 +403,7 @@ def process_html_with_model(html_content, model_response):
                 elif para.endswith(':') or (para.isupper() and len(para.split()) <= 8):
                     # Headings
                     new_element = soup.new_tag('h2', **{'class': 'heading'})
-                elif any(sig in para.lower() for sig in ['signature', 'signed by', 'dated', 'by:', 'name:', 'title:']):
+                elif _has_keyword(_PARA_SIG_AC, para):
                     # Signature blocks
                     new_element = soup.new_tag('div', **{'class': 'signature'})
                 elif para.startswith(tuple('123456789')) and '.' in para[:10]:
@@ -257,11 +440,35 @@ def save_pdf(pdf_buffer, original_filename):
     pdf_filename = f"{os.path.splitext(original_filename)[0]}_{timestamp}_{unique_id}.pdf"
     pdf_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "generated_pdfs", pdf_filename)
     
+    # Stream the buffer to disk in 64 KiB blocks rather than copying it whole with getvalue()
+    pdf_buffer.seek(0)
     with open(pdf_path, 'wb') as f:
-        f.write(pdf_buffer.getvalue())
+        shutil.copyfileobj(pdf_buffer, f, length=1 << 16)
     print(f"[PDF Generated] Saved to: {pdf_path}")
     return pdf_path
 
+# Directory content-addressed job PDFs are stored in
+GENERATED_PDF_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "generated_pdfs")
+
+# Save PDF under a content-addressed name - identical output is stored once
+def store_pdf(pdf_buffer):
+    """Write the PDF to generated_pdfs/<blake2b digest>.pdf unless it is already there"""
+    pdf_bytes = pdf_buffer.getbuffer()
+    digest = hashlib.blake2b(pdf_bytes, digest_size=16).hexdigest()
+    pdf_path = os.path.join(GENERATED_PDF_DIR, f"{digest}.pdf")
+    
+    if os.path.exists(pdf_path):
+        print(f"[PDF Reused] {pdf_path}")
+    else:
+        # Write then rename, so a concurrent reader never sees a partial file
+        tmp_path = f"{pdf_path}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(pdf_bytes)
+        os.replace(tmp_path, pdf_path)
+        print(f"[PDF Generated] Saved to: {pdf_path}")
+    del pdf_bytes  # release the buffer export so pdf_buffer can be resized again
+    return pdf_path
+
 # Generate a simplified fallback PDF when HTML conversion fails
 def generate_simple_pdf(pdf_buffer, text_content):
     """Generate minimal PDF when HTML conversion fails - simplified approach"""
@@ -302,26 +509,102 @@ def generate_simple_pdf(pdf_buffer, text_content):
     doc.build(content)
     return pdf_buffer
 
+# Render a tiny document once so ReportLab font/encoding registration and the
+# xhtml2pdf CSS setup happen at startup instead of inside the first job
+def warm_up_pdf_renderer():
+    """Prime xhtml2pdf/ReportLab state before the first real PDF"""
+    try:
+        pisa.CreatePDF(_PDF_WARMUP_HTML, dest=BytesIO())
+        print("✅ PDF renderer warmed up")
+    except Exception as e:
+        print(f"⚠️ PDF renderer warm-up failed: {str(e)}")
+
+# Render HTML to PDF bytes with xhtml2pdf - runs inside a PDF pool worker
+def _render_pdf(html_content):
+    """xhtml2pdf render returning the PDF bytes"""
+    pdf_buffer = BytesIO()
+    pdf_status = pisa.CreatePDF(html_content, dest=pdf_buffer)
+    if pdf_status.err:
+        raise Exception(f"xhtml2pdf conversion failed with error: {pdf_status.err}")
+    
+    pdf_bytes = pdf_buffer.getvalue()
+    # ReportLab leaves reference cycles behind; reclaim them now after large
+    # renders rather than letting RSS creep up between GC passes
+    if len(pdf_bytes) > GC_AFTER_PDF_BYTES:
+        gc.collect()
+    return pdf_bytes
+
+# Process pool for xhtml2pdf - rendering is CPU-bound pure Python, so in-process it
+# holds the GIL against every other job. Workers are spawned (the server process
+# is multithreaded, so no fork), warm themselves up, and are recycled every
+# PDF_WORKER_MAX_TASKS renders to shed ReportLab's leaked memory
+_pdf_pool = None
+_pdf_pool_lock = threading.Lock()
+
+def _get_pdf_pool():
+    """Get or create the PDF rendering pool (None when disabled)"""
+    global _pdf_pool
+    
+    if _pdf_pool is not None or PDF_RENDER_PROCESSES <= 0:
+        return _pdf_pool
+    
+    with _pdf_pool_lock:
+        if _pdf_pool is None:
+            pool_kwargs = {}
+            if sys.version_info >= (3, 11):
+                pool_kwargs['max_tasks_per_child'] = PDF_WORKER_MAX_TASKS
+            _pdf_pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=PDF_RENDER_PROCESSES,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=warm_up_pdf_renderer,
+                **pool_kwargs
+            )
+    return _pdf_pool
+
+# No-op task - its only purpose is to make the pool spawn a worker
+def _pdf_worker_ready():
+    return True
+
+# Start PDF rendering at boot, so the first job doesn't pay for spawning workers
+def start_pdf_renderer():
+    """Spawn and warm the render pool, or warm this process when rendering in-process"""
+    pool = _get_pdf_pool()
+    if pool is None:
+        warm_up_pdf_renderer()
+        return
+    # Workers are spawned on demand, one per submit while none is idle, and warm
+    # themselves up in the pool initializer - the results are not waited for
+    for _ in range(PDF_RENDER_PROCESSES):
+        pool.submit(_pdf_worker_ready)
+    print(f"🔄 PDF render pool starting: {PDF_RENDER_PROCESSES} processes")
+
+# Render in the pool, recreating it once if a worker died and took the pool down
+def _render_pdf_in_pool(html_content):
+    global _pdf_pool
+    
+    pool = _get_pdf_pool()
+    if pool is None:
+        return _render_pdf(html_content)
+    try:
+        return pool.submit(_render_pdf, html_content).result()
+    except concurrent.futures.process.BrokenProcessPool:
+        print("⚠️ PDF pool broken - restarting it")
+        with _pdf_pool_lock:
+            if _pdf_pool is pool:
+                _pdf_pool = None
+        return _get_pdf_pool().submit(_render_pdf, html_content).result()
+
 # Unified PDF generation function
 def generate_pdf(html_content, text_content=None):
     """Unified PDF generation with simple fallback"""
-    from xhtml2pdf import pisa
-    from io import BytesIO
-    
-    pdf_buffer = BytesIO()
-    
     try:
         # Primary: Try xhtml2pdf
-        pdf_status = pisa.CreatePDF(html_content, dest=pdf_buffer)
-        
-        if pdf_status.err:
-            print(f"xhtml2pdf failed with error: {pdf_status.err}")
-            raise Exception("xhtml2pdf conversion failed")
+        pdf_bytes = _render_pdf_in_pool(html_content)
         
         # Check if PDF has content
-        if pdf_buffer.getvalue() and len(pdf_buffer.getvalue()) > 100:
+        if len(pdf_bytes) > 100:
             print("✅ PDF generated successfully with xhtml2pdf")
-            return pdf_buffer
+            return BytesIO(pdf_bytes)
         else:
             raise Exception("Generated PDF is empty")
             
@@ -1,15 +1,113 @@
+import os
 import re
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import cache, lru_cache
+import ahocorasick
+import numpy as np
+
+# Hyperscan (optional) - SIMD multi-literal matcher for very long documents
+try:
+    import hyperscan
+except ImportError:
+    hyperscan = None
+
+# Numba (optional) - compiles the chunk scoring kernel
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
 from modules.bedrock_integration import BedrockClient
 
-# Initialize Bedrock client
-bedrock_client = BedrockClient()
+# Token counting - tiktoken's cl100k_base is a close enough proxy for the
+# Mistral tokenizer to size chunks; fall back to ~4 chars/token without it
+try:
+    import tiktoken
+    _token_encoding = tiktoken.get_encoding('cl100k_base')
+except ImportError:
+    _token_encoding = None
+
+# Instruction-parsing patterns, compiled once at import
+# Single pass over double- or single-quoted text (group 1 or group 2)
+_QUOTES = re.compile(r'"([^"]*)"|\'([^\']*)\'')
+# Separators between the parts of a multi-part instruction (matched on bytes)
+_PART_RE = re.compile(rb'\n|\d+\.|\s*-\s*')
+
+# Common contract fields an instruction may refer to
+_COMMON_FIELDS = [
+    "effective date", "term", "termination", "governing law", "state", 
+    "jurisdiction", "payment terms", "client", "provider", "customer",
+    "representative", "fee", "price", "pricing", "deliverable", "party", "parties",
+    "section", "article", "clause", "paragraph", "agreement", "contract"
+]
+
+# Aho-Corasick automaton over the common fields - finds every field in a single
+# linear sweep, independent of how many fields there are
+_FIELDS_AC = ahocorasick.Automaton()
+for _field in _COMMON_FIELDS:
+    _FIELDS_AC.add_word(_field, _field)
+_FIELDS_AC.make_automaton()
+
+# Key verbs that indicate actions in an instruction part
+_ACTION_VERBS = ["change", "modify", "replace", "update", "set", "remove", "delete", "add", "insert"]
+# All of them as whole words, found in one pass per part
+_VERB_RE = re.compile(rb'\b(' + b'|'.join(verb.encode('ascii') for verb in _ACTION_VERBS) + rb')\b',
+                      re.IGNORECASE)
+
+# Documents at least this long are scanned with Hyperscan when it is installed;
+# below it the database compile costs more than the scan saves
+HYPERSCAN_MIN_DOC_LENGTH = 100000
+
+# Bedrock client, created on first use so importing this module stays cheap
+@cache
+def _bedrock():
+    """Shared BedrockClient for chunk processing"""
+    return BedrockClient()
+
+# Not cached - the splitter measures every fragment it tries, and a cache would
+# keep whole documents and all those fragments alive
+def count_tokens(text):
+    """Approximate number of model tokens in text"""
+    if _token_encoding is None:
+        return len(text) // 4 + 1
+    return len(_token_encoding.encode(text, disallowed_special=()))
+
+# Edited chunks keyed on (chunk, instruction) digests - retries and repeated
+# edits of the same document skip the Bedrock call for chunks already done
+CHUNK_CACHE_SIZE = int(os.environ.get('CHUNK_CACHE_SIZE', 4096))
+_chunk_cache = OrderedDict()
+_chunk_cache_lock = threading.Lock()
+
+def _chunk_cache_key(chunk, instruction):
+    """128-bit blake2b digests of the chunk and the instruction"""
+    return (hashlib.blake2b(chunk.encode('utf-8'), digest_size=16).digest() +
+            hashlib.blake2b(instruction.encode('utf-8'), digest_size=16).digest())
 
 # Process a single chunk sequentially with a simple direct approach
 def process_chunk(chunk, instruction, chunk_id):
     """Process chunk using Bedrock"""
+    key = _chunk_cache_key(chunk, instruction)
+    with _chunk_cache_lock:
+        cached = _chunk_cache.get(key)
+        if cached is not None:
+            _chunk_cache.move_to_end(key)
+    if cached is not None:
+        print(f"Using cached result for chunk {chunk_id}")
+        return cached, True
+    
     try:
         # Use the Bedrock client to process the chunk
-        return bedrock_client.process_chunk(chunk, instruction, chunk_id)
+        result, changed = _bedrock().process_chunk(chunk, instruction, chunk_id)
+        
+        # Only successful edits are cached; (chunk, False) may be a swallowed error
+        if changed:
+            with _chunk_cache_lock:
+                _chunk_cache[key] = result
+                if len(_chunk_cache) > CHUNK_CACHE_SIZE:
+                    _chunk_cache.popitem(last=False)
+        return result, changed
     except Exception as e:
         print(f"Error processing chunk {chunk_id}: {str(e)}")
         # Return original chunk on error
@@ -25,185 +123,424 @@ def process_chunk_with_change_detection(chunk, instruction, chunk_id):
         # Return original chunk on error, mark as unchanged
         return chunk, False
 
+# Compiled Hyperscan databases, keyed on the instruction's needle set
+@lru_cache(maxsize=128)
+def _compile_needle_db(needles):
+    """Compile a case-insensitive Hyperscan block database for a tuple of literals"""
+    db = hyperscan.Database()
+    db.compile(
+        expressions=[re.escape(needle).encode('utf-8') for needle in needles],
+        ids=list(range(len(needles))),
+        flags=[hyperscan.HS_FLAG_CASELESS | hyperscan.HS_FLAG_SOM_LEFTMOST] * len(needles)
+    )
+    return db
+
+# Hyperscan scratch spaces of the current thread, per database. The compiled
+# databases are shared, but a scratch may only be used by one scan at a time
+_hyperscan_local = threading.local()
+
+def _thread_scratch(db):
+    """This thread's scratch for db"""
+    scratches = getattr(_hyperscan_local, 'scratches', None)
+    if scratches is None:
+        scratches = _hyperscan_local.scratches = {}
+    entry = scratches.get(id(db))
+    if entry is None or entry[0] is not db:
+        # Same bound as the database cache - evicted databases' scratches go with it
+        if len(scratches) >= 128:
+            scratches.clear()
+        entry = scratches[id(db)] = (db, hyperscan.Scratch(db))
+    return entry[1]
+
+# Reduce every (needle, start, end) hit to the regex alternation's match set
+def _leftmost_longest(matches):
+    """Non-overlapping matches, leftmost first and longest at each start"""
+    last_end = 0
+    for needle, start, end in sorted(matches, key=lambda match: (match[1], match[1] - match[2])):
+        if start >= last_end:
+            yield needle, start, end
+            last_end = end
+
+# Char offset of every UTF-8 byte offset (0..len) - only needed for non-ASCII text
+def _byte_to_char_offsets(doc_bytes):
+    """table[b] is the number of characters that start before byte offset b"""
+    char_starts = (np.frombuffer(doc_bytes, dtype=np.uint8) & 0xC0) != 0x80
+    table = np.zeros(len(doc_bytes) + 1, dtype=np.int64)
+    np.cumsum(char_starts, out=table[1:])
+    return table
+
+# Context windows around every match of the instruction's literal needles
+def _needle_spans(document, needles):
+    """Scan document once for all needles; returns (start, end) char offsets
+    
+    needles maps each lowercased literal to (chars kept before the match,
+    first occurrence only); 200 chars are always kept after the match.
+    """
+    seen_first_only = set()
+    
+    # ASCII needles are matched on the UTF-8 bytes: multi-byte sequences never
+    # contain ASCII bytes, so hits line up with characters, and bytes.lower()
+    # keeps offsets intact. Match offsets are mapped back to chars before the
+    # windows are applied, so windows are always measured in characters.
+    use_bytes = all(needle.isascii() for needle in needles)
+    if use_bytes:
+        text = document.encode('utf-8')
+    else:
+        text = document
+    doc_len = len(document)
+    
+    def windows(matches):
+        for needle, start, end in matches:
+            context_before, first_only = needles.get(needle, (100, False))
+            if first_only:
+                if needle in seen_first_only:
+                    continue
+                seen_first_only.add(needle)
+            
+            # Context window around the match
+            context_start = max(0, start - context_before)
+            context_end = min(doc_len, end + 200)
+            yield context_start, context_end
+    
+    if use_bytes and hyperscan is not None and len(document) >= HYPERSCAN_MIN_DOC_LENGTH:
+        needle_list = tuple(sorted(needles))
+        hits = []
+        
+        def on_match(needle_id, start, end, flags, context):
+            hits.append((needle_list[needle_id], start, end))
+        
+        db = _compile_needle_db(needle_list)
+        db.scan(text, match_event_handler=on_match, scratch=_thread_scratch(db))
+        # Hyperscan reports every overlapping hit - keep the ones the regex paths would find
+        matches = _leftmost_longest(hits)
+    elif use_bytes:
+        # One compiled alternation over the ASCII-lowercased bytes, longest
+        # first so that a longer needle wins over one of its own substrings
+        pattern = re.compile(
+            b'|'.join(re.escape(needle.encode('ascii')) for needle in sorted(needles, key=len, reverse=True))
+        )
+        matches = ((m.group(0).decode('ascii'), m.start(), m.end()) for m in pattern.finditer(text.lower()))
+    else:
+        pattern = re.compile(
+            '|'.join(re.escape(needle) for needle in sorted(needles, key=len, reverse=True)),
+            re.IGNORECASE
+        )
+        matches = ((m.group(0).lower(), m.start(), m.end()) for m in pattern.finditer(document))
+    
+    if use_bytes and len(text) != doc_len:
+        # Non-ASCII document - match edges fall on character boundaries, map them to chars
+        char_at = _byte_to_char_offsets(text)
+        matches = ((needle, int(char_at[start]), int(char_at[end])) for needle, start, end in matches)
+    return list(windows(matches))
+
+# O(N log N) replacement for the pairwise "target in existing" check
+def _dedupe_spans(spans):
+    """Drop spans contained in another span; returns the rest sorted by start"""
+    unique_spans = []
+    max_end = -1
+    # Widest span first among those sharing a start
+    for start, end in sorted(spans, key=lambda span: (span[0], -span[1])):
+        if end > max_end:
+            unique_spans.append((start, end))
+            max_end = end
+    return unique_spans
+
+# Streaming split of an instruction into its parts
+def _instruction_part_spans(instr_bytes):
+    """Yield (start, end) byte offsets of the text between part separators"""
+    last = 0
+    for match in _PART_RE.finditer(instr_bytes):
+        yield last, match.start()
+        last = match.end()
+    yield last, len(instr_bytes)
+
 # Enhanced function to find instruction targets
 def find_instruction_targets(instruction, document):
     """Enhanced target identification for better chunk prioritization"""
-    targets = []
-    
+    # Sections are tracked as (start, end) offsets and only the ones surviving
+    # deduplication are sliced - prioritize_chunks matches their text in chunks
+    spans = []
     # Extract quoted text (likely direct references)
-    quoted_text = re.findall(r'"([^"]*)"', instruction)
-    quoted_text.extend(re.findall(r"'([^']*)'", instruction))
+    quoted_text = [m.group(1) if m.group(1) is not None else m.group(2)
+                   for m in _QUOTES.finditer(instruction)]
+    
+    # Quoted and verb-target literals to look for in the document, lowercased,
+    # mapped to their context: (chars kept before the match, first occurrence only)
+    needles = {}
     
-    # Process each quoted text segment
+    # Quoted text segments - all occurrences
     for text in quoted_text:
         if len(text) > 3:
-            # Look for case-insensitive matches
-            text_lower = text.lower()
-            doc_lower = document.lower()
-            
-            # Try to find all occurrences 
-            start_pos = 0
-            while start_pos < len(doc_lower):
-                found_pos = doc_lower.find(text_lower, start_pos)
-                if found_pos == -1:
-                    break
-                
-                # Extract a context window around the match
-                context_start = max(0, found_pos - 100)
-                context_end = min(len(document), found_pos + len(text) + 200)
-                context = document[context_start:context_end]
-                targets.append(context)
-                
-                # Move to next position
-                start_pos = found_pos + len(text)
+            needles.setdefault(text.lower(), (100, False))
     
     # Split instruction into individual requests (common for multi-part instructions)
-    instruction_parts = re.split(r'\n|\d+\.|\s*-\s*', instruction)
+    instr_bytes = instruction.encode('utf-8')
     
     # Process each instruction part
-    for part in instruction_parts:
-        part = part.strip()
+    for part_start, part_end in _instruction_part_spans(instr_bytes):
+        part = instr_bytes[part_start:part_end].strip()
         if len(part) < 5:  # Skip very short parts
             continue
-            
-        # Extract key verbs and subjects that indicate actions
-        action_verbs = ["change", "modify", "replace", "update", "set", "remove", "delete", "add", "insert"]
         
-        # Look for action verbs followed by potential targets
-        for verb in action_verbs:
-            if verb in part.lower():
-                verb_pos = part.lower().find(verb)
-                # Extract the target phrase (text after the verb)
-                if verb_pos >= 0 and verb_pos + len(verb) + 1 < len(part):
-                    target_phrase = part[verb_pos + len(verb):].strip()
-                    if len(target_phrase) > 3:
-                        # Find this phrase in the document
-                        # Use first few words for searching
-                        search_terms = " ".join(target_phrase.split()[:3])
-                        if len(search_terms) > 3:
-                            # Look for the search terms in document
-                            doc_lower = document.lower()
-                            search_lower = search_terms.lower()
-                            found_pos = doc_lower.find(search_lower)
-                            if found_pos >= 0:
-                                # Extract context around match
-                                context_start = max(0, found_pos - 100)
-                                context_end = min(len(document), found_pos + len(search_terms) + 200)
-                                context = document[context_start:context_end]
-                                targets.append(context)
-    
-    # Look for common fields in contracts
-    common_fields = [
-        "effective date", "term", "termination", "governing law", "state", 
-        "jurisdiction", "payment terms", "client", "provider", "customer",
-        "representative", "fee", "price", "pricing", "deliverable", "party", "parties",
-        "section", "article", "clause", "paragraph", "agreement", "contract"
-    ]
-    
-    # Add any common fields mentioned in the instruction
-    for field in common_fields:
-        if field in instruction.lower():
-            # Find this field in the document (could be multiple occurrences)
-            field_lower = field.lower()
-            doc_lower = document.lower()
+        # Look for action verbs followed by potential targets - first occurrence of each verb
+        seen_verbs = set()
+        for verb_match in _VERB_RE.finditer(part):
+            verb = verb_match.group(1).lower()
+            if verb in seen_verbs:
+                continue
+            seen_verbs.add(verb)
             
-            # Find all occurrences
-            start_pos = 0
-            while start_pos < len(doc_lower):
-                found_pos = doc_lower.find(field_lower, start_pos)
-                if found_pos == -1:
-                    break
-                
-                # Extract a context window around the match
-                context_start = max(0, found_pos - 50)
-                context_end = min(len(document), found_pos + len(field) + 200)
-                context = document[context_start:context_end]
-                targets.append(context)
-                
-                # Move to next position
-                start_pos = found_pos + len(field)
-    
-    # Remove duplicates and near-duplicates
-    unique_targets = []
-    for target in targets:
-        # Check if this target is too similar to existing ones
-        is_duplicate = False
-        for existing in unique_targets:
-            # Simple overlap check
-            if target in existing or existing in target:
-                is_duplicate = True
-                break
-        
-        if not is_duplicate:
-            unique_targets.append(target)
+            # Extract the target phrase (text after the verb)
+            if verb_match.end() + 1 < len(part):
+                target_phrase = part[verb_match.end():].strip()
+                if len(target_phrase) > 3:
+                    # Use first few words for searching - first occurrence only
+                    search_terms = b" ".join(target_phrase.split()[:3]).decode('utf-8', errors='ignore')
+                    if len(search_terms) > 3:
+                        needles.setdefault(search_terms.lower(), (100, True))
+    
+    # One pass over the document for all quoted and verb-target needles
+    if needles:
+        spans.extend(_needle_spans(document, needles))
+    
+    # Common fields mentioned in the instruction - all occurrences in the document
+    mentioned_fields = {field for _, field in _FIELDS_AC.iter(instruction.lower())}
+    if mentioned_fields:
+        doc_len = len(document)
+        for end_idx, field in _FIELDS_AC.iter(document.lower()):
+            if field not in mentioned_fields:
+                continue
+            
+            # Context window around the match
+            found_pos = end_idx - len(field) + 1
+            context_start = max(0, found_pos - 50)
+            context_end = min(doc_len, end_idx + 201)
+            spans.append((context_start, context_end))
+    
+    # Remove sections contained in another, then sections whose text repeats an
+    # earlier one (boilerplate at several positions would otherwise be scored
+    # once per copy by prioritize_chunks)
+    unique_targets = list(dict.fromkeys(document[start:end] for start, end in _dedupe_spans(spans)))
     
     print(f"Found {len(unique_targets)} unique target sections in document")
     return unique_targets
 
-# Enhanced chunk prioritization
-def prioritize_chunks(chunks, targets):
-    """Enhanced prioritization based on targets and chunk importance"""
-    # Score each chunk based on target presence and relevance
-    chunk_scores = []
-    for i, chunk in enumerate(chunks):
-        # Initialize score for this chunk
-        score = 0
-        chunk_lower = chunk.lower()
-        
-        # Score based on target presence
-        for target in targets:
-            target_lower = target.lower()
+# Literal anchors of a targeted instruction: quoted text and common fields
+def instruction_anchors(instruction):
+    """Lowercased quoted text (over 3 chars) and common fields named in the instruction
+    
+    An empty result means the instruction is not targeted at specific text, so
+    every chunk has to go through the model.
+    """
+    anchors = set()
+    for m in _QUOTES.finditer(instruction):
+        text = m.group(1) if m.group(1) is not None else m.group(2)
+        if len(text) > 3:
+            anchors.add(text.lower())
+    anchors.update(field for _, field in _FIELDS_AC.iter(instruction.lower()))
+    return anchors
+
+# Section headings/contract structure markers that might indicate important parts
+_STRUCTURE_MARKERS = [
+    "section", "article", "clause", "paragraph", 
+    "parties", "agreement", "witnesseth", "whereas",
+    "term", "termination", "payment", "services", "obligations",
+    "governing law", "liability", "indemnification"
+]
+
+# Compiled scoring kernel (optional) - same rules as _automaton_scores, run over
+# chunks packed into one byte array. Serial: it is called from concurrent job
+# threads, and Numba's default parallel threading layer is not thread-safe
+if njit is not None:
+    @njit(cache=True)
+    def _score_kernel(text, offsets, needles, needle_offsets, full_idx, half_idx, marker_idx):
+        n_chunks = len(offsets) - 1
+        n_needles = len(needle_offsets) - 1
+        scores = np.zeros(n_chunks, dtype=np.int64)
+        for c in range(n_chunks):
+            c_start = offsets[c]
+            c_end = offsets[c + 1]
+            chunk_len = c_end - c_start
             
-            # If target is fully contained in chunk, add higher score
-            if target_lower in chunk_lower:
-                score += 5
-                
-                # Extra points if it's at the beginning or middle of the chunk (more likely to be complete)
-                target_pos = chunk_lower.find(target_lower)
-                if target_pos < len(chunk) // 3:  # In the first third
-                    score += 2
-                elif target_pos < len(chunk) * 2 // 3:  # In the middle third
-                    score += 1
+            # Leftmost position of every needle in this chunk, -1 when absent
+            first_pos = np.full(n_needles, -1, dtype=np.int64)
+            for k in range(n_needles):
+                n_start = needle_offsets[k]
+                n_len = needle_offsets[k + 1] - n_start
+                if n_len == 0:
+                    first_pos[k] = 0
+                    continue
+                for i in range(c_start, c_end - n_len + 1):
+                    if text[i] != needles[n_start]:
+                        continue
+                    j = 1
+                    while j < n_len and text[i + j] == needles[n_start + j]:
+                        j += 1
+                    if j == n_len:
+                        first_pos[k] = i - c_start
+                        break
             
-            # If at least half of the target is in the chunk
-            elif len(target_lower) > 10:
-                # Check for partial matches (first half or second half)
-                first_half = target_lower[:len(target_lower)//2]
-                second_half = target_lower[len(target_lower)//2:]
-                
-                if first_half in chunk_lower:
-                    score += 2
-                if second_half in chunk_lower:
-                    score += 2
-        
-        # Look for section headings/contract structure markers that might indicate important parts
-        structure_markers = [
-            "section", "article", "clause", "paragraph", 
-            "parties", "agreement", "witnesseth", "whereas",
-            "term", "termination", "payment", "services", "obligations",
-            "governing law", "liability", "indemnification"
-        ]
-        
-        # Add points for structure markers
-        for marker in structure_markers:
-            if marker in chunk_lower:
-                score += 1
+            score = 0
+            for t in range(len(full_idx)):
+                pos = first_pos[full_idx[t]]
+                if pos >= 0:
+                    score += 5
+                    if pos < chunk_len // 3:
+                        score += 2
+                    elif pos < chunk_len * 2 // 3:
+                        score += 1
+                elif half_idx[t, 0] >= 0:
+                    if first_pos[half_idx[t, 0]] >= 0:
+                        score += 2
+                    if first_pos[half_idx[t, 1]] >= 0:
+                        score += 2
+            for k in range(len(marker_idx)):
+                if first_pos[marker_idx[k]] >= 0:
+                    score += 1
+            scores[c] = score
+        return scores
+else:
+    _score_kernel = None
+
+# One automaton over every target, target half and structure marker
+def _build_priority_automaton(targets):
+    """Map each needle to the (kind, target index) scoring rules it feeds"""
+    automaton = ahocorasick.Automaton()
+    rules = {}
+    for t_idx, target in enumerate(targets):
+        target_lower = target.lower()
+        rules.setdefault(target_lower, []).append(('full', t_idx))
+        # Partial matches (first half or second half) for longer targets
+        if len(target_lower) > 10:
+            half = len(target_lower) // 2
+            rules.setdefault(target_lower[:half], []).append(('half', t_idx))
+            rules.setdefault(target_lower[half:], []).append(('half', t_idx))
+    for marker in _STRUCTURE_MARKERS:
+        rules.setdefault(marker, []).append(('marker', None))
+    
+    for needle, needle_rules in rules.items():
+        automaton.add_word(needle, (len(needle), needle_rules))
+    automaton.make_automaton()
+    return automaton
+
+# Score chunks with the Aho-Corasick automaton (any text)
+def _automaton_scores(chunks, targets):
+    """Priority score of every chunk, as an int64 array"""
+    automaton = _build_priority_automaton(targets)
+    
+    # Collect (chunk, target, position) hits; the arithmetic is done in NumPy below
+    full_c, full_t, full_pos = [], [], []
+    half_c, half_t = [], []
+    marker_c = []
+    for i, chunk in enumerate(chunks):
+        # Single pass; matches arrive by end offset, so the first hit of a
+        # needle is its leftmost occurrence
+        first_pos = {}
+        for end_idx, (needle_len, needle_rules) in automaton.iter(chunk.lower()):
+            if id(needle_rules) not in first_pos:
+                first_pos[id(needle_rules)] = (end_idx - needle_len + 1, needle_rules)
         
-        # Store score with chunk index
-        chunk_scores.append((i, score))
+        for target_pos, needle_rules in first_pos.values():
+            for kind, t_idx in needle_rules:
+                if kind == 'full':
+                    full_c.append(i)
+                    full_t.append(t_idx)
+                    full_pos.append(target_pos)
+                elif kind == 'half':
+                    half_c.append(i)
+                    half_t.append(t_idx)
+                else:
+                    marker_c.append(i)
     
-    # Sort chunks by score (descending) and original order for equally scored chunks
-    chunk_scores.sort(key=lambda x: (-x[1], x[0]))
+    scores = np.zeros(len(chunks), dtype=np.int64)
+    chunk_lens = np.array([len(chunk) for chunk in chunks], dtype=np.int64)
+    full_c = np.array(full_c, dtype=np.int64)
+    full_t = np.array(full_t, dtype=np.int64)
+    full_pos = np.array(full_pos, dtype=np.int64)
+    
+    # Target fully contained in chunk: 5, plus 2 in the first third or 1 in the
+    # middle third of the chunk (more likely to be complete)
+    hit_lens = chunk_lens[full_c]
+    bonus = np.where(full_pos < hit_lens // 3, 2, np.where(full_pos < hit_lens * 2 // 3, 1, 0))
+    np.add.at(scores, full_c, 5 + bonus)
+    
+    # Half matches, 2 each, only count for targets not fully present
+    if half_c:
+        half_c = np.array(half_c, dtype=np.int64)
+        half_t = np.array(half_t, dtype=np.int64)
+        fully_present = np.zeros((len(chunks), len(targets)), dtype=bool)
+        fully_present[full_c, full_t] = True
+        keep = ~fully_present[half_c, half_t]
+        np.add.at(scores, half_c[keep], 2)
+    
+    # Structure markers, 1 each
+    np.add.at(scores, np.array(marker_c, dtype=np.int64), 1)
+    
+    return scores
+
+# Score chunks with the compiled kernel (ASCII text only - byte offsets are char offsets)
+def _numba_scores(chunks, targets):
+    """Priority score of every chunk, as an int64 array"""
+    # Unique needles and, per target, the indices of its full/half needles
+    needle_index = {}
+    def index_of(needle):
+        return needle_index.setdefault(needle, len(needle_index))
+    
+    n_targets = len(targets)
+    full_idx = np.empty(n_targets, dtype=np.int64)
+    half_idx = np.full((n_targets, 2), -1, dtype=np.int64)
+    for t_idx, target in enumerate(targets):
+        target_lower = target.lower()
+        full_idx[t_idx] = index_of(target_lower)
+        if len(target_lower) > 10:
+            half = len(target_lower) // 2
+            half_idx[t_idx, 0] = index_of(target_lower[:half])
+            half_idx[t_idx, 1] = index_of(target_lower[half:])
+    marker_idx = np.array([index_of(marker) for marker in _STRUCTURE_MARKERS], dtype=np.int64)
+    
+    # Pack chunks and needles into flat byte arrays plus offset tables
+    chunk_bytes = [chunk.lower().encode('ascii') for chunk in chunks]
+    needle_bytes = [needle.encode('ascii') for needle in needle_index]
+    text = np.frombuffer(b''.join(chunk_bytes), dtype=np.uint8)
+    offsets = np.zeros(len(chunks) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(b) for b in chunk_bytes])
+    needles = np.frombuffer(b''.join(needle_bytes), dtype=np.uint8)
+    needle_offsets = np.zeros(len(needle_bytes) + 1, dtype=np.int64)
+    needle_offsets[1:] = np.cumsum([len(b) for b in needle_bytes])
+    
+    return _score_kernel(text, offsets, needles, needle_offsets, full_idx, half_idx, marker_idx)
+
+# Compile (or load from Numba's on-disk cache) the kernel at import, with the
+# argument types _numba_scores passes, instead of on the first job's request path
+if _score_kernel is not None:
+    try:
+        _numba_scores(["section 1. warm-up"], ["warm-up"])
+    except Exception as e:
+        print(f"⚠️ Numba kernel compilation failed, using the automaton scorer: {str(e)}")
+        _score_kernel = None
+
+# Enhanced chunk prioritization
+def prioritize_chunks(chunks, targets):
+    """Enhanced prioritization based on targets and chunk importance
+    
+    Returns (prioritized_chunks, scores), with scores in the same order.
+    """
+    # Score each chunk based on target presence and relevance
+    if (_score_kernel is not None and all(chunk.isascii() for chunk in chunks)
+            and all(target.isascii() for target in targets)):
+        scores = _numba_scores(chunks, targets)
+    else:
+        scores = _automaton_scores(chunks, targets)
     
-    # Extract the reordering
-    prioritized_indices = [i for i, _ in chunk_scores]
+    # Sort chunks by score (descending) and original order for equally scored chunks
+    prioritized_indices = np.argsort(-scores, kind='stable').tolist()
     
     # Create debug output to show the prioritization
     print("Chunk prioritization:")
-    for idx, (orig_idx, score) in enumerate(chunk_scores):
-        print(f"  Position {idx}: Chunk {orig_idx} (score: {score})")
+    for idx, orig_idx in enumerate(prioritized_indices):
+        print(f"  Position {idx}: Chunk {orig_idx} (score: {scores[orig_idx]})")
     
     # Reorder chunks based on scores
     prioritized_chunks = [chunks[i] for i in prioritized_indices]
     
-    return prioritized_chunks 
\ No newline at end of file
+    return prioritized_chunks, scores[prioritized_indices].tolist()
@@ -2,13 +2,17 @@ import threading
 import time
 import os
 import logging
+import statistics
+from collections import deque
 from datetime import datetime, timedelta
 from modules.bedrock_integration import BedrockClient
 
-# Configure logging for warmup
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+# Module logger - handlers and level are set by the application entrypoint
 logger = logging.getLogger('warmup_scheduler')
 
+# Request-time updates closer together than this are dropped
+REQUEST_UPDATE_COALESCE_SECONDS = 1.0
+
 class ModelWarmupScheduler:
     def __init__(self, warmup_interval_minutes=15):
         """
@@ -18,49 +22,160 @@ class ModelWarmupScheduler:
             warmup_interval_minutes (int): How often to send warmup requests (default: 15 minutes)
         """
         self.warmup_interval = warmup_interval_minutes * 60  # Convert to seconds
+        self.max_warmup_interval = self.warmup_interval  # Adaptive interval never grows past the configured one
+        self.min_warmup_interval = 60
+        
+        # Rolling window of warmup response times, used to spot cold starts
+        self.response_times = deque(maxlen=20)
+        self.baseline_response_time = None
+        self.stable_samples = 0
+        self.stable_samples_to_grow = 5
         self.bedrock_client = BedrockClient()
         self.model_id = os.environ.get('BEDROCK_MODEL_ID', 'mistral.mistral-8b-instruct-v1:0')
+        
+        # The warmup request never changes - serialize it once.
+        # Minimal warmup prompt - only 3-4 tokens total, minimal response
+        self._warmup_kwargs = {
+            'model_id': self.model_id,
+            'body': BedrockClient.build_request_body("<s>[INST] Hi [/INST]", max_tokens=5, temperature=0.1)
+        }
         self.is_running = False
         self.warmup_thread = None
-        self.last_real_request = datetime.now()
+        self._wake = threading.Event()  # Set by stop() to end the current wait immediately
+        self.last_real_request_ts = time.monotonic()  # Plain float - one clock read per update
+        
+        # Hermes-style prewarm knob: fraction of the interval before a warmup is
+        # considered, and the expected-benefit probability needed to send one.
+        # Smaller K warms more eagerly (fewer cold starts, more warmup calls).
+        self.K = float(os.environ.get('WARMUP_K', 0.7))
+        # Recent gaps between user requests, in seconds
+        self.request_gaps = deque(maxlen=100)
+        self.min_gap_samples = 5
+        
         self.warmup_stats = {
             'total_warmups': 0,
             'successful_warmups': 0,
             'failed_warmups': 0,
             'last_warmup': None,
-            'last_warmup_success': None
+            'last_warmup_success': None,
+            'cold_start_penalty_ms': None,
+            'stabilization_index': None
         }
         
+    def idle_seconds(self):
+        """Seconds since the last real user request"""
+        return time.monotonic() - self.last_real_request_ts
+        
     def update_last_request_time(self):
         """Call this whenever a real user request is processed"""
-        self.last_real_request = datetime.now()
-        logger.debug(f"Updated last real request time: {self.last_real_request}")
+        now = time.monotonic()
+        gap = now - self.last_real_request_ts
+        # Coalesce bursts - a timestamp under a second old is as good as a new one
+        if gap < REQUEST_UPDATE_COALESCE_SECONDS:
+            return
+        self.request_gaps.append(gap)
+        self.last_real_request_ts = now
         
     def should_warmup(self):
         """
         Determine if we should send a warmup request
         Returns True if last real request was more than warmup_interval ago
         """
-        time_since_last_request = datetime.now() - self.last_real_request
-        should_warmup = time_since_last_request.total_seconds() > (self.warmup_interval * 0.8)  # 80% of interval
-        return should_warmup
+        idle_seconds = self.idle_seconds()
+        if idle_seconds <= self.warmup_interval * self.K:
+            return False
+        if idle_seconds > self.warmup_interval:
+            return True  # Model has probably gone cold already
+        
+        p_e = self.warmup_benefit_probability(idle_seconds)
+        if p_e is None:
+            return True  # Not enough traffic history - warm on the idle threshold alone
+        return p_e >= self.K
+        
+    def warmup_benefit_probability(self, idle_seconds):
+        """
+        Probability that a warmup sent now prevents a cold start (Hermes p_e = p_s * P(t_c > t_s + t_p))
+        
+        Estimated from the request gaps longer than the current idle time t_s:
+        p_s is the share that outlasts the warmup interval (the model would go
+        cold before the next request), and the second factor the share that
+        outlasts t_s plus the warmup duration t_p (the warmup finishes first).
+        Returns None while there are too few gaps to estimate from.
+        """
+        if len(self.request_gaps) < self.min_gap_samples:
+            return None
+        
+        remaining_gaps = [gap for gap in self.request_gaps if gap > idle_seconds]
+        if not remaining_gaps:
+            return 1.0  # Idle for longer than any gap seen - traffic has stopped
+        
+        prewarm_seconds = self.response_times[-1] if self.response_times else 0.0
+        p_s = sum(gap > self.warmup_interval for gap in remaining_gaps) / len(remaining_gaps)
+        p_late = sum(gap > idle_seconds + prewarm_seconds for gap in remaining_gaps) / len(remaining_gaps)
+        return p_s * p_late
+        
+    def record_response_time(self, response_time):
+        """
+        Adapt the warmup interval to the observed warmup response times
+        
+        A response well above the warm baseline means the model went cold before
+        this warmup, so the interval is halved (floor 60s). After several stable
+        samples in a row it grows again by 1.25x, up to the configured interval.
+        """
+        self.response_times.append(response_time)
+        if len(self.response_times) < 3:
+            return
+        
+        mean = statistics.fmean(self.response_times)
+        stdev = statistics.pstdev(self.response_times)
+        # Coefficient of variation - below 0.1 the warm latency has stabilized
+        stabilization_index = stdev / mean if mean > 0 else 0.0
+        self.warmup_stats['stabilization_index'] = round(stabilization_index, 3)
+        
+        if self.baseline_response_time is None or (stabilization_index < 0.1 and mean < self.baseline_response_time):
+            self.baseline_response_time = mean
+        
+        if response_time > 2 * self.baseline_response_time:
+            # Cold start observed - warm up more often
+            self.warmup_stats['cold_start_penalty_ms'] = round((response_time - self.baseline_response_time) * 1000)
+            self.warmup_interval = max(self.min_warmup_interval, self.warmup_interval / 2)
+            self.stable_samples = 0
+            logger.info("🥶 Cold start detected (%.2fs vs %.2fs baseline) - warmup interval now %.1f minutes",
+                        response_time, self.baseline_response_time, self.warmup_interval / 60)
+        elif stabilization_index < 0.1:
+            self.stable_samples += 1
+            if self.stable_samples >= self.stable_samples_to_grow:
+                self.warmup_interval = min(self.max_warmup_interval, self.warmup_interval * 1.25)
+                self.stable_samples = 0
+                logger.debug("Warm latency stable - warmup interval now %.1f minutes", self.warmup_interval / 60)
+        else:
+            self.stable_samples = 0
         
-    def send_warmup_request(self):
-        """Send a minimal warmup request to keep the model alive"""
+    def _next_delay(self, warmed):
+        """Seconds to wait before the next warmup check (warmed: a warmup was just sent)"""
+        if warmed:
+            # The model was just warmed - wait a full interval
+            return self.warmup_interval
+        idle_seconds = self.idle_seconds()
+        threshold = self.warmup_interval * self.K
+        if idle_seconds >= threshold:
+            # The K gate declined - check again before the model goes cold
+            return max(1.0, self.warmup_interval - idle_seconds)
+        # Recent user activity - check again right when the model could go cold
+        return max(1.0, threshold - idle_seconds)
+        
+    def send_warmup_request(self, record_latency=True):
+        """Send a minimal warmup request to keep the model alive
+        
+        record_latency=False leaves the response time out of the adaptive
+        interval samples (the startup warmup is always cold).
+        """
         try:
-            # Minimal warmup prompt - only 3-4 tokens total
-            warmup_prompt = "<s>[INST] Hi [/INST]"
-            
             logger.info("🔥 Sending warmup request to Bedrock...")
             start_time = time.time()
             
-            # Send warmup request using the configured model ID
-            response = self.bedrock_client._call_bedrock_with_retry(
-                model_id=self.model_id,  # Use the configured model ID
-                prompt=warmup_prompt,
-                max_tokens=5,  # Minimal response
-                temperature=0.1
-            )
+            # Send the pre-built warmup request using the configured model ID
+            response = self.bedrock_client._call_bedrock_with_retry(**self._warmup_kwargs)
             
             response_time = time.time() - start_time
             
@@ -69,8 +184,10 @@ class ModelWarmupScheduler:
             self.warmup_stats['successful_warmups'] += 1
             self.warmup_stats['last_warmup'] = datetime.now()
             self.warmup_stats['last_warmup_success'] = True
+            if record_latency:
+                self.record_response_time(response_time)
             
-            logger.info(f"✅ Warmup successful in {response_time:.2f}s - Model is warm and ready")
+            logger.info("✅ Warmup successful in %.2fs - Model is warm and ready", response_time)
             return True
             
         except Exception as e:
@@ -79,30 +196,41 @@ class ModelWarmupScheduler:
             self.warmup_stats['last_warmup'] = datetime.now()
             self.warmup_stats['last_warmup_success'] = False
             
-            logger.error(f"❌ Warmup failed: {str(e)}")
+            logger.error("❌ Warmup failed: %s", e)
             return False
             
     def warmup_worker(self):
         """Background thread that handles periodic warmup"""
-        logger.info(f"⏰ Warmup scheduler started - periodic warmup every {self.warmup_interval/60:.1f} minutes")
+        # Send initial warmup request immediately on startup - from this thread, so
+        # server boot doesn't block on it, while the TLS handshake, credential
+        # resolution and model load still happen before the first user request
+        logger.info("🚀 Sending initial warmup request on startup...")
+        # Its cold latency would inflate the warm baseline, so it is not sampled
+        if self.send_warmup_request(record_latency=False):
+            logger.info("✅ Initial warmup successful - model is ready!")
+        else:
+            logger.warning("⚠️ Initial warmup failed - will retry on schedule")
+        
+        logger.info("⏰ Warmup scheduler started - periodic warmup every %.1f minutes", self.warmup_interval / 60)
         
         # Small initial delay to avoid immediate warmup after startup warmup
-        time.sleep(30)  # Wait 30 seconds before starting periodic schedule
+        self._wake.wait(timeout=30)  # Wait 30 seconds before starting periodic schedule
         
         while self.is_running:
             try:
                 # Check if we need to warmup
-                if self.should_warmup():
+                warmed = self.should_warmup()
+                if warmed:
                     self.send_warmup_request()
                 else:
                     logger.debug("⏭️ Skipping warmup - recent user activity detected")
                 
-                # Sleep for the warmup interval
-                time.sleep(self.warmup_interval)
+                # Wait until the next check is due, or until stop() wakes us
+                self._wake.wait(timeout=self._next_delay(warmed))
                 
             except Exception as e:
-                logger.error(f"Error in warmup worker: {str(e)}")
-                time.sleep(60)  # Wait 1 minute before retrying on error
+                logger.error("Error in warmup worker: %s", e)
+                self._wake.wait(timeout=60)  # Wait 1 minute before retrying on error
                 
     def start(self):
         """Start the warmup scheduler"""
@@ -111,14 +239,7 @@ class ModelWarmupScheduler:
             return
             
         self.is_running = True
-        
-        # Send initial warmup request immediately on startup
-        logger.info("🚀 Sending initial warmup request on startup...")
-        initial_success = self.send_warmup_request()
-        if initial_success:
-            logger.info("✅ Initial warmup successful - model is ready!")
-        else:
-            logger.warning("⚠️ Initial warmup failed - will retry on schedule")
+        self._wake.clear()
         
         self.warmup_thread = threading.Thread(target=self.warmup_worker, daemon=True)
         self.warmup_thread.start()
@@ -130,6 +251,7 @@ class ModelWarmupScheduler:
             return
             
         self.is_running = False
+        self._wake.set()
         if self.warmup_thread:
             self.warmup_thread.join(timeout=5)
         logger.info("🛑 Warmup scheduler stopped")
@@ -145,28 +267,39 @@ class ModelWarmupScheduler:
             stats['success_rate'] = 0
             
         # Add time since last request
-        stats['minutes_since_last_request'] = (datetime.now() - self.last_real_request).total_seconds() / 60
+        stats['warmup_interval_minutes'] = self.warmup_interval / 60
+        idle_seconds = self.idle_seconds()
+        stats['minutes_since_last_request'] = idle_seconds / 60
         
         # Add next warmup estimate
         if self.should_warmup():
             stats['next_warmup'] = "Soon (model likely cold)"
         else:
-            next_warmup_time = self.last_real_request + timedelta(seconds=self.warmup_interval * 0.8)
+            next_warmup_time = datetime.now() + timedelta(seconds=self.warmup_interval * self.K - idle_seconds)
             stats['next_warmup'] = next_warmup_time.strftime("%H:%M:%S")
             
         return stats
 
 # Global warmup scheduler instance
 warmup_scheduler = None
+_warmup_scheduler_lock = threading.Lock()
 
 def initialize_warmup_scheduler(warmup_interval_minutes=15):
     """Initialize and start the global warmup scheduler"""
     global warmup_scheduler
     
-    if warmup_scheduler is None:
-        warmup_scheduler = ModelWarmupScheduler(warmup_interval_minutes)
-        warmup_scheduler.start()
-        logger.info(f"🔥 Global warmup scheduler initialized with {warmup_interval_minutes} minute intervals")
+    if warmup_scheduler is not None:
+        return warmup_scheduler
+    
+    # Double-checked - concurrent callers must not start two schedulers
+    # (two worker threads would each send warmup requests)
+    with _warmup_scheduler_lock:
+        if warmup_scheduler is None:
+            scheduler = ModelWarmupScheduler(warmup_interval_minutes)
+            scheduler.start()
+            # Published only once started, so the lock-free read above never sees a half-initialized scheduler
+            warmup_scheduler = scheduler
+            logger.info("🔥 Global warmup scheduler initialized with %s minute intervals", warmup_interval_minutes)
     
     return warmup_scheduler
 
@@ -1,37 +1,81 @@
 import os
 import uuid
-import re
-from datetime import datetime
-from io import BytesIO
+import time
 import base64
-import fitz  # PyMuPDF
+import binascii
+import mmap
 import threading
 import queue
-import json
-import re
-from bs4 import BeautifulSoup
-from xhtml2pdf import pisa
-import html
+import logging
 import concurrent.futures  # For parallel processing
-from flask import Flask, request, jsonify
+from urllib.parse import quote
+from flask import Flask, request, jsonify, send_file
+from flask.json.provider import DefaultJSONProvider
 from dotenv import load_dotenv
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# streaming-form-data (optional) - parses multipart uploads incrementally as they
+# arrive, instead of Werkzeug buffering the whole body before the handler runs
+try:
+    from streaming_form_data import StreamingFormDataParser, ParseFailedException
+    from streaming_form_data.targets import FileTarget, ValueTarget
+except ImportError:
+    StreamingFormDataParser = None
+
 # Load environment variables from .env file (for local development)
 load_dotenv()
 
+# Logging is configured here, by the entrypoint - modules only create their loggers
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
 # Import modules
-from modules.job_processing import job_queue, job_results, start_processing_thread, process_document
+from modules.job_processing import (
+    job_queues, job_store, processing_threads, enqueue_job, queued_job_count,
+    start_processing_threads, process_document, cleanup_upload
+)
+from modules.pdf_utils import start_pdf_renderer
 from modules.bedrock_integration import BedrockClient
 from modules.warmup_scheduler import initialize_warmup_scheduler, get_warmup_scheduler, update_last_request_time
 
-# Initialize Bedrock client
+# Initialize Bedrock client - creates the shared pooled bedrock-runtime client at
+# boot; the warmup scheduler's startup request then opens its first connection
 bedrock_client = BedrockClient()
 
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON provider backed by orjson - responses carry multi-MB base64 PDFs"""
+    # Dates go through Flask's default (HTTP-date strings) instead of orjson's ISO-8601
+    OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME if orjson is not None else 0
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=self.OPTIONS).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        """jsonify body - orjson bytes go straight into the response, skipping
+        the str round-trip of DefaultJSONProvider.response"""
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj, default=self.default, option=self.OPTIONS),
+                                        mimetype=self.mimetype)
+
 # Configure Flask with increased max content length (100MB)
 app = Flask(__name__)
+if orjson is not None:
+    app.json = OrjsonProvider(app)
 app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100MB
 app.config['JSON_AS_ASCII'] = False  # Properly handle Unicode
 
+# Offload PDF downloads to the front-end web server. X_ACCEL_PDF_PREFIX is the
+# nginx internal location aliased to generated_pdfs/ (e.g. /internal_pdfs);
+# USE_X_SENDFILE enables Flask's X-Sendfile header for Apache/lighttpd
+X_ACCEL_PDF_PREFIX = os.environ.get('X_ACCEL_PDF_PREFIX', '').rstrip('/')
+app.use_x_sendfile = os.environ.get('USE_X_SENDFILE', '').lower() in ('1', 'true', 'yes')
+
 # Initialize paths for document storage
 script_dir = os.path.dirname(os.path.abspath(__file__))
 UPLOAD_FOLDER = os.path.join(script_dir, "uploaded_docs")
@@ -39,19 +83,107 @@ PDF_OUTPUT_FOLDER = os.path.join(script_dir, "generated_pdfs")
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(PDF_OUTPUT_FOLDER, exist_ok=True)
 
+# Long-lived pool for jobs run outside the shard workers - threads (and their
+# warm Bedrock connections) are reused instead of spawning a thread per job
+EXECUTOR = concurrent.futures.ThreadPoolExecutor(
+    max_workers=int(os.environ.get('BEDROCK_WORKERS', 8)),
+    thread_name_prefix='bedrock'
+)
+MAX_EXECUTOR_BACKLOG = int(os.environ.get('MAX_EXECUTOR_BACKLOG', 16))
+
+# Jobs queued anywhere - submissions are refused with 503 beyond MAX_QUEUED_JOBS
+MAX_QUEUED_JOBS = int(os.environ.get('MAX_QUEUED_JOBS', 100))
+
+def executor_backlog():
+    """Tasks submitted to EXECUTOR that no thread has picked up yet"""
+    return EXECUTOR._work_queue.qsize()
+
+def queue_saturated():
+    return queued_job_count() + executor_backlog() >= MAX_QUEUED_JOBS
+
+# Bytes read from the request stream per parser step when streaming uploads
+UPLOAD_READ_CHUNK_SIZE = 64 * 1024
+
+# Stream a multipart upload straight from the socket into UPLOAD_FOLDER
+def stream_upload(job_id):
+    """Parse the request body incrementally - returns (instruction, file_path, original_filename)
+    
+    Raises ParseFailedException for a body that is not valid multipart/form-data.
+    """
+    file_path = os.path.join(UPLOAD_FOLDER, f"{job_id}.upload")
+    instruction_target = ValueTarget()
+    file_target = FileTarget(file_path)
+    
+    try:
+        # Fails on a missing or malformed Content-Type boundary
+        parser = StreamingFormDataParser(headers=request.headers)
+        parser.register('instruction', instruction_target)
+        parser.register('file', file_target)
+        
+        while True:
+            chunk = request.stream.read(UPLOAD_READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            parser.data_received(chunk)
+    except Exception:
+        cleanup_upload(file_path)
+        raise
+    
+    instruction = instruction_target.value.decode('utf-8', errors='replace')
+    return instruction, file_path, file_target.multipart_filename
+
 # Print startup message
 print(f"Starting server with AWS Bedrock integration")
 print(f"AWS Region: {os.environ.get('AWS_REGION', 'Not set')}")
 print(f"Upload folder: {UPLOAD_FOLDER}")
 print(f"PDF output folder: {PDF_OUTPUT_FOLDER}")
 
-# Start the job processing thread with Bedrock
-processing_thread = start_processing_thread()
-print(f"🔄 Processing thread started: {processing_thread is not None}")
+# Background services are started once per process. Job state (queues and
+# job_store) lives in this process, so the server runs as a single gunicorn
+# worker and scales with --threads (see Procfile) - more workers would each
+# own separate jobs and each send their own warmups
+_background_services_lock = threading.Lock()
+_background_services_started = False
 
-# Initialize and start the warmup scheduler (15-minute intervals)
-warmup_scheduler = initialize_warmup_scheduler(warmup_interval_minutes=15)
-print(f"🔥 Warmup scheduler initialized - keeping model warm every 15 minutes")
+def start_background_services():
+    """Start the job workers and warmup scheduler (idempotent)"""
+    global _background_services_started
+    with _background_services_lock:
+        if _background_services_started:
+            return
+        
+        # Start the sharded job processing threads with Bedrock
+        start_processing_threads()
+        print(f"🔄 Processing threads started: {len(processing_threads)} shards")
+        
+        # Spawn the PDF render workers (or warm the in-process renderer) now,
+        # not on the first job
+        start_pdf_renderer()
+        
+        # Initialize and start the warmup scheduler (15-minute intervals)
+        initialize_warmup_scheduler(warmup_interval_minutes=15)
+        print(f"🔥 Warmup scheduler initialized - keeping model warm every 15 minutes")
+        
+        _background_services_started = True
+
+# Spawned helper processes (the PDF rendering pool) re-import this file as
+# __mp_main__ when it is run directly - they must not start workers or warmups
+if __name__ != '__mp_main__':
+    start_background_services()
+
+# Base64 of a generated PDF, read through mmap - no intermediate bytes copy
+def read_pdf_base64(pdf_path):
+    """Encode the PDF at pdf_path as base64 text (None if it is missing)"""
+    if not pdf_path:
+        return None
+    # The shared file can be unlinked by another job's expiry at any point, and
+    # mmap refuses zero-length files - both mean there is no PDF to return
+    try:
+        with open(pdf_path, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as pdf_map:
+                return base64.b64encode(pdf_map).decode('ascii')
+    except (FileNotFoundError, ValueError):
+        return None
 
 @app.route('/health', methods=['GET'])
 def health_check():
@@ -102,62 +234,58 @@ def trigger_warmup():
 @app.route('/upload', methods=['POST'])
 def upload_document():
     """Upload document for processing"""
+    # Back-pressure - refuse before reading the body when the backlog is full
+    if queue_saturated():
+        return jsonify({"error": "Server is busy, try again later"}), 503
+    
     try:
-        instruction = request.form.get('instruction')
-        if 'file' not in request.files:
-            return jsonify({"error": "No file part"}), 400
-            
-        file = request.files['file']
-        if not file or file.filename == '':
-            return jsonify({"error": "No file selected"}), 400
-            
-        if not instruction:
-            return jsonify({"error": "No instruction provided"}), 400
-        
         # Generate a unique job ID
         job_id = str(uuid.uuid4())
         
-        # Save the file
-        original_filename = file.filename
-        file_path = os.path.join(UPLOAD_FOLDER, f"{job_id}_{original_filename}")
-        file.save(file_path)
+        if StreamingFormDataParser is not None:
+            if request.mimetype != 'multipart/form-data':
+                return jsonify({"error": "Expected a multipart/form-data upload"}), 400
+            
+            # Stream the file to disk as it arrives - memory stays flat regardless of
+            # upload size; the job cleans the file up once it has been processed
+            try:
+                instruction, file_data, original_filename = stream_upload(job_id)
+            except (ParseFailedException, ValueError) as e:
+                return jsonify({"error": f"Malformed multipart upload: {str(e)}"}), 400
+            if not original_filename:
+                cleanup_upload(file_data)
+                return jsonify({"error": "No file selected"}), 400
+            if not instruction:
+                cleanup_upload(file_data)
+                return jsonify({"error": "No instruction provided"}), 400
+        else:
+            instruction = request.form.get('instruction')
+            if 'file' not in request.files:
+                return jsonify({"error": "No file part"}), 400
+                
+            file = request.files['file']
+            if not file or file.filename == '':
+                return jsonify({"error": "No file selected"}), 400
+                
+            if not instruction:
+                return jsonify({"error": "No instruction provided"}), 400
+            
+            # Keep the upload in memory - PyMuPDF parses the bytes directly, so
+            # there is no need to round-trip the document through UPLOAD_FOLDER
+            original_filename = file.filename
+            file_data = file.stream.read()
         
         # Create job entry
-        job_results[job_id] = {
+        job_store.set(job_id, {
             'status': 'queued',
             'progress': 0,
             'message': 'Job queued for processing with AWS Bedrock',
-            'created_at': datetime.now().isoformat()
-        }
+            'created_at': time.time()  # epoch seconds; format with datetime.fromtimestamp when displayed
+        })
         
-        # Add job to the queue
-        job_queue.put((job_id, instruction, file_path, original_filename))
-        
-        # Check if processing thread is alive - if not, trigger immediate processing
-        thread_alive = processing_thread.is_alive() if processing_thread else False
-        if not thread_alive:
-            print(f"⚠️ Processing thread is dead, triggering immediate processing for job {job_id}")
-            # Process in background thread to avoid blocking the upload response
-            import threading
-            
-            def process_immediately():
-                try:
-                    # Get the job we just added
-                    if not job_queue.empty():
-                        job_data = job_queue.get(timeout=1)
-                        job_id_from_queue, instruction_from_queue, file_path_from_queue, filename_from_queue = job_data
-                        print(f"Processing job {job_id_from_queue} immediately")
-                        process_document(job_id_from_queue, instruction_from_queue, file_path_from_queue, filename_from_queue)
-                except Exception as e:
-                    print(f"Immediate processing error for {job_id}: {e}")
-                    if job_id in job_results:
-                        job_results[job_id]['status'] = 'error'
-                        job_results[job_id]['message'] = f"Processing error: {str(e)}"
-            
-            immediate_thread = threading.Thread(target=process_immediately, daemon=True)
-            immediate_thread.start()
-            
-            job_results[job_id]['message'] = 'Processing started immediately (background thread backup)'
+        # Add job to its queue shard - a supervisor restarts dead workers, so
+        # the handler never has to process jobs itself
+        enqueue_job(job_id, instruction, file_data, original_filename)
         
         # Update warmup scheduler - real user request received
         update_last_request_time()
@@ -176,10 +304,12 @@ def upload_document():
 @app.route('/job_status/<job_id>', methods=['GET'])
 def get_job_status(job_id):
     """Get status of a job"""
-    if job_id not in job_results:
+    job = job_store.get(job_id)
+    if job is None:
         return jsonify({"error": "Job not found"}), 404
         
-    job = job_results[job_id]
+    # Metadata only - polls stay a few hundred bytes; results come from
+    # /job_pdf (binary PDF) or /job_result (JSON) once the job is completed
     response = {
         'job_id': job_id,
         'status': job['status'],
@@ -187,20 +317,52 @@ def get_job_status(job_id):
         'message': job['message']
     }
     
-    # Include results if job is completed
-    if job['status'] == 'completed':
-        response['pdf_base64'] = job.get('pdf_base64', '')
-        response['response'] = job.get('response', '')
-    
     return jsonify(response), 200
 
+@app.route('/job_pdf/<job_id>', methods=['GET'])
+def get_job_pdf(job_id):
+    """Download the generated PDF of a completed job"""
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    
+    if job['status'] != 'completed':
+        return jsonify({
+            'job_id': job_id,
+            'status': job['status'],
+            'progress': job['progress'],
+            'message': 'Job not completed yet'
+        }), 202
+    
+    pdf_path = job.get('pdf_path')
+    if not pdf_path or not os.path.exists(pdf_path):
+        return jsonify({"error": "PDF no longer available"}), 410
+    
+    download_name = job.get('pdf_filename') or os.path.basename(pdf_path)
+    
+    # Behind nginx - hand the file to nginx, which streams it with sendfile(2)
+    if X_ACCEL_PDF_PREFIX:
+        response = app.response_class(status=200, mimetype='application/pdf')
+        response.headers['X-Accel-Redirect'] = f"{X_ACCEL_PDF_PREFIX}/{os.path.basename(pdf_path)}"
+        if download_name.isascii():
+            response.headers.set('Content-Disposition', 'attachment', filename=download_name)
+        else:
+            response.headers.set('Content-Disposition', 'attachment',
+                                 **{'filename*': f"UTF-8''{quote(download_name)}"})
+        return response
+    
+    # Served straight from disk (sendfile where available, X-Sendfile when
+    # enabled), with Range/ETag support
+    return send_file(pdf_path, mimetype='application/pdf', conditional=True,
+                     download_name=download_name)
+
 @app.route('/job_result/<job_id>', methods=['GET'])
 def get_job_result(job_id):
-    """Get the full result of a completed job"""
-    if job_id not in job_results:
+    """Get the full result of a completed job (deprecated for the PDF - use /job_pdf)"""
+    job = job_store.get(job_id)
+    if job is None:
         return jsonify({"error": "Job not found"}), 404
         
-    job = job_results[job_id]
     if job['status'] != 'completed':
         return jsonify({
             'job_id': job_id,
@@ -209,17 +371,29 @@ def get_job_result(job_id):
             'message': 'Job not completed yet'
         }), 202
     
-    # Return the full result
-    return jsonify({
+    # Return the full result - the PDF is base64-encoded on demand from the
+    # memory-mapped file, jobs keep only its path
+    pdf_base64 = read_pdf_base64(job.get('pdf_path'))
+    if pdf_base64 is None:
+        return jsonify({"error": "PDF no longer available"}), 404
+    
+    response = jsonify({
         'job_id': job_id,
         'status': 'completed',
         'response': job.get('response', ''),
-        'pdf_base64': job.get('pdf_base64', '')
-    }), 200
+        'pdf_base64': pdf_base64
+    })
+    # Base64-in-JSON is kept for existing clients; point them at the binary route
+    response.headers['Deprecation'] = 'true'
+    response.headers['Link'] = f'</job_pdf/{job_id}>; rel="alternate"; type="application/pdf"'
+    return response, 200
 
 @app.route('/process_text', methods=['POST'])
 def process_text():
     """Legacy endpoint that redirects to the new asynchronous flow"""
+    if queue_saturated():
+        return jsonify({"error": "Server is busy, try again later"}), 503
+    
     try:
         data = request.get_json()
         
@@ -229,57 +403,36 @@ def process_text():
         instruction = data['instruction']
         document_content = data['document_content']
         
+        # Binary documents (PDFs) must arrive base64-encoded - a PDF pushed through a
+        # JSON string and re-encoded as UTF-8 is corrupted
+        if data.get('encoding') == 'base64':
+            try:
+                file_data = base64.b64decode(document_content, validate=True)
+            except (binascii.Error, TypeError, ValueError):
+                return jsonify({"error": "document_content is not valid base64"}), 400
+            file_ext = '.pdf' if file_data.startswith(b'%PDF') else '.txt'
+        elif document_content.startswith('%PDF'):
+            return jsonify({"error": "PDF content must be sent base64-encoded with \"encoding\": \"base64\""}), 400
+        else:
+            file_data = document_content.encode('utf-8')
+            file_ext = '.txt'
+        
         # Generate a unique job ID
         job_id = str(uuid.uuid4())
         
-        # Save the document content to a temporary file
-        file_ext = '.pdf' if document_content.startswith('%PDF') else '.txt'
+        # Keep the document in memory, like /upload - the job reads the bytes directly
         temp_filename = f"temp_doc_{job_id}{file_ext}"
-        file_path = os.path.join(UPLOAD_FOLDER, temp_filename)
-        
-        mode = 'wb' if file_ext == '.pdf' else 'w'
-        with open(file_path, mode) as f:
-            if file_ext == '.pdf':
-                f.write(document_content.encode('utf-8', errors='replace'))
-            else:
-                f.write(document_content)
         
         # Create job entry
-        job_results[job_id] = {
+        job_store.set(job_id, {
             'status': 'queued',
             'progress': 0,
             'message': 'Job queued for processing with AWS Bedrock',
-            'created_at': datetime.now().isoformat()
-        }
+            'created_at': time.time()  # epoch seconds; format with datetime.fromtimestamp when displayed
+        })
         
-        # Add job to the queue
-        job_queue.put((job_id, instruction, file_path, temp_filename))
-        
-        # Check if processing thread is alive - if not, trigger immediate processing
-        thread_alive = processing_thread.is_alive() if processing_thread else False
-        if not thread_alive:
-            print(f"⚠️ Processing thread is dead, triggering immediate processing for job {job_id}")
-            # Process in background thread to avoid blocking the upload response
-            import threading
-            
-            def process_immediately():
-                try:
-                    # Get the job we just added
-                    if not job_queue.empty():
-                        job_data = job_queue.get(timeout=1)
-                        job_id_from_queue, instruction_from_queue, file_path_from_queue, filename_from_queue = job_data
-                        print(f"Processing job {job_id_from_queue} immediately")
-                        process_document(job_id_from_queue, instruction_from_queue, file_path_from_queue, filename_from_queue)
-                except Exception as e:
-                    print(f"Immediate processing error for {job_id}: {e}")
-                    if job_id in job_results:
-                        job_results[job_id]['status'] = 'error'
-                        job_results[job_id]['message'] = f"Processing error: {str(e)}"
-            
-            immediate_thread = threading.Thread(target=process_immediately, daemon=True)
-            immediate_thread.start()
-            
-            job_results[job_id]['message'] = 'Processing started immediately (background thread backup)'
+        # Add job to its queue shard
+        enqueue_job(job_id, instruction, file_data, temp_filename)
         
         # Update warmup scheduler - real user request received
         update_last_request_time()
@@ -298,65 +451,56 @@ def process_text():
 @app.route('/debug/queue', methods=['GET'])
 def debug_queue():
     """Debug endpoint to check queue status and trigger processing"""
-    queue_size = job_queue.qsize()
-    thread_alive = processing_thread.is_alive() if processing_thread else False
+    queue_size = queued_job_count()
+    threads_alive = sum(worker.is_alive() for worker in processing_threads)
     
-    # Count jobs by status
-    status_counts = {}
-    for job_id, job in job_results.items():
-        status = job['status']
-        status_counts[status] = status_counts.get(status, 0) + 1
+    # Counts are maintained on each status transition - no scan over the jobs
+    status_counts = job_store.status_counts()
     
     return jsonify({
         "queue_size": queue_size,
-        "processing_thread_alive": thread_alive,
+        "processing_thread_alive": threads_alive == len(processing_threads),
+        "processing_threads_alive": threads_alive,
+        "queue_shards": len(job_queues),
         "job_status_counts": status_counts,
-        "total_jobs": len(job_results)
+        "total_jobs": sum(status_counts.values())
     }), 200
 
 @app.route('/debug/process_queue', methods=['POST'])
 def trigger_queue_processing():
     """Manually trigger queue processing (for debugging Render issues)"""
     try:
-        processed_count = 0
         max_jobs = 5  # Limit to prevent timeout
         
-        while not job_queue.empty() and processed_count < max_jobs:
+        if executor_backlog() > MAX_EXECUTOR_BACKLOG:
+            return jsonify({"error": "Processing pool is saturated, try again later"}), 503
+        
+        # Drain with get_nowait - one lock round-trip per job, no empty()/get race
+        # and no 1-second stall when another consumer wins the job
+        jobs = []
+        for job_queue in job_queues:
             try:
-                # Get job from queue with short timeout
-                job_id, instruction, file_path, original_filename = job_queue.get(timeout=1)
-                
-                # Process immediately in the current request context
-                print(f"Manually processing job {job_id}")
-                
-                # Start processing in background thread to avoid blocking the request
-                import threading
-                
-                def process_in_background():
-                    try:
-                        process_document(job_id, instruction, file_path, original_filename)
-                    except Exception as e:
-                        print(f"Background processing error for {job_id}: {e}")
-                        if job_id in job_results:
-                            job_results[job_id]['status'] = 'error'
-                            job_results[job_id]['message'] = f"Processing error: {str(e)}"
-                
-                bg_thread = threading.Thread(target=process_in_background, daemon=True)
-                bg_thread.start()
-                
-                processed_count += 1
-                
+                while len(jobs) < max_jobs:
+                    jobs.append(job_queue.get_nowait())
             except queue.Empty:
-                break
+                pass
+        
+        for job_id, instruction, file_path, original_filename in jobs:
+            # Process immediately in the current request context
+            print(f"Manually processing job {job_id}")
+            
+            # Run on the shared pool so the request is not blocked
+            EXECUTOR.submit(process_document, job_id, instruction, file_path, original_filename)
         
         return jsonify({
-            "message": f"Triggered processing for {processed_count} jobs",
-            "processed_jobs": processed_count,
-            "remaining_queue_size": job_queue.qsize()
+            "message": f"Triggered processing for {len(jobs)} jobs",
+            "processed_jobs": len(jobs),
+            "remaining_queue_size": queued_job_count()
         }), 200
         
     except Exception as e:
         return jsonify({"error": f"Queue processing failed: {str(e)}"}), 500
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5001)
+    # Development server only - production runs under gunicorn (see Procfile)
+    app.run(host='0.0.0.0', port=int(os.environ.get('PORT', 5001)), threaded=True)